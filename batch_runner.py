@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+Filename: batch_runner.py
+Date created: 2026/10/18, Sun, 10:12:00 (UTC+8)
+@author: LioHong
+Purpose: Launch evolve_batch jobs and detect when their PHASCII outputs are done.
+Steps:
+1. Register each expected PHASCII with its step and the Popen handle that writes it.
+2. Wait on the handles.
+3. Mark each expected step done exactly once.
+4. Keep a fixed number of slots busy, launching the next step as soon as one frees up.
+5. Launch evolve_batch directly from an argument vector instead of a .bat file per step.
+6. Hold back new launches while finished-but-unscraped snapshots exceed a disk budget.
+
+"""
+import os
+import lzma
+import queue
+import threading
+import subprocess
+from pathlib import Path
+from time import monotonic
+from datetime import datetime
+from collections import deque
+
+# The .bat templates cd here before calling evolve_batch.
+evolve_dirpath = Path("C:/Program Files (x86)/Evolve")
+
+
+# Tracks the PHASCII files expected from a bunch of launched batches.
+# Each expected step is marked done exactly once, when its process exits.
+class CompletionTracker(object):
+    def __init__(self):
+        # step: PHASCII path, for steps that have not been marked yet.
+        self.pending = {}
+        # Steps in order of completion, and steps whose process exited without a PHASCII.
+        self.done = []
+        self.failed = []
+        # Number of times wait() woke up. Replaces the old busy-loop "Count:".
+        self.wakeups = 0
+        self.events = queue.Queue()
+
+    def __len__(self):
+        return len(self.pending)
+
+    # Register a step. Its process exiting marks the step, with or without a PHASCII.
+    def expect(self, step, phas_path, proc):
+        self.pending[step] = Path(phas_path)
+        threading.Thread(target=self.watch_proc, args=(step, proc), daemon=True).start()
+
+    def watch_proc(self, step, proc):
+        proc.wait()
+        self.events.put(step)
+
+    # Returns True only the first time a step is marked.
+    def mark_done(self, step):
+        phas_path = self.pending.pop(step, None)
+        if phas_path is None:
+            return False
+        if phas_path.exists():
+            self.done.append(step)
+        else:
+            self.failed.append(step)
+        return True
+
+    # Block until at least one pending step completes, then return all steps newly completed.
+    def wait(self, timeout=None):
+        if not self.pending:
+            return []
+        try:
+            steps = [self.events.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        self.wakeups += 1
+        while True:
+            try:
+                steps.append(self.events.get_nowait())
+            except queue.Empty:
+                break
+        return [s for s in steps if self.mark_done(s)]
+
+
+# Bounded pool of concurrent evolve_batch launches.
+# Replaces the fixed bunches: the next pending step starts the moment any slot frees up.
+class LaunchPool(object):
+    def __init__(self, slots=None, tracker=None, budget=None, snapshots=None, wait_interval=0.5):
+        # Default to one slot per core.
+        self.slots = slots or os.cpu_count() or 1
+        self.tracker = tracker if tracker is not None else CompletionTracker()
+        # Optional semaphore shared with other pools, e.g. one per run under the orchestrator.
+        self.budget = budget
+        # Optional SnapshotBudget: launches pause while too many snapshot bytes await the scraper.
+        self.snapshots = snapshots
+        # Seconds between re-checks of the disk budget while nothing of ours is running.
+        self.wait_interval = wait_interval
+        # (step, PHASCII path, launch) where launch() returns a Popen handle.
+        self.queued = deque()
+        # step: [Popen, start time, PHASCII path]
+        self.running = {}
+        self.step_secs = []
+        self.peak = 0
+        self.started_at = None
+        self.finished_at = None
+        # Set by stop(): nothing more gets launched.
+        self.stopped = False
+
+    def submit(self, step, phas_path, launch):
+        self.queued.append((step, Path(phas_path), launch))
+
+    def fill(self):
+        while self.queued and not self.stopped and len(self.running) < self.slots:
+            # Never waits for the scraper here: it can only free space once the finished steps reach it.
+            if self.snapshots is not None and self.snapshots.over():
+                break
+            # Only block for a shared core when none of ours is running, else wait for our own exits.
+            if self.budget is not None and not self.budget.acquire(not self.running):
+                break
+            step, phas_path, launch = self.queued.popleft()
+            try:
+                proc = launch()
+            except Exception:
+                # The step never gets into self.running, so kill_all() would not hand its core back.
+                if self.budget is not None:
+                    self.budget.release()
+                raise
+            self.running[step] = [proc, monotonic(), phas_path]
+            self.tracker.expect(step, phas_path, proc)
+        self.peak = max(self.peak, len(self.running))
+
+    # Yield steps in order of completion. Steps may be submitted while iterating.
+    def as_completed(self):
+        if self.started_at is None:
+            self.started_at = monotonic()
+        try:
+            self.fill()
+            while self.running or self.queued:
+                if not self.running:
+                    # Held back by the disk budget with every finished step already handed out,
+                    # so the scraper is working through them. Re-check now and then rather than block.
+                    if self.snapshots is not None:
+                        self.snapshots.wait_below(self.wait_interval)
+                    self.fill()
+                    continue
+                for step in self.tracker.wait():
+                    proc, t0, phas_path = self.running.pop(step)
+                    self.step_secs.append(monotonic() - t0)
+                    if self.budget is not None:
+                        self.budget.release()
+                    if self.snapshots is not None:
+                        self.snapshots.add(step, [phas_path, phas_path.with_suffix(".evolve")])
+                    # Must kill spare processes to prevent memory leak.
+                    proc.kill()
+                    # Hand the step out before launching more, so nothing can hold it back from the scraper.
+                    yield step
+                    self.fill()
+                self.fill()
+        finally:
+            self.kill_all()
+            self.finished_at = monotonic()
+
+    def run(self):
+        return [step for step in self.as_completed()]
+
+    # From another thread, e.g. when the scraper fails: drop the queued steps and kill the running ones.
+    # as_completed() then hands the killed steps out, most likely as failed, and ends.
+    def stop(self):
+        self.stopped = True
+        self.queued.clear()
+        for proc, t0, phas_path in list(self.running.values()):
+            proc.kill()
+
+    def kill_all(self):
+        for proc, t0, phas_path in self.running.values():
+            proc.kill()
+            if self.budget is not None:
+                self.budget.release()
+        self.running.clear()
+
+    # Per-run throughput stats.
+    def stats(self):
+        end = self.finished_at if self.finished_at is not None else monotonic()
+        elapsed = end - self.started_at if self.started_at is not None else 0.0
+        done = len(self.step_secs)
+        return {"slots": self.slots,
+                "steps": done,
+                "failed": len(self.tracker.failed),
+                "elapsed_s": round(elapsed, 3),
+                "steps_per_hour": round(done * 3600 / elapsed, 1) if elapsed else 0.0,
+                "mean_step_s": round(sum(self.step_secs) / done, 3) if done else 0.0,
+                "peak_running": self.peak}
+
+    def report(self):
+        st = self.stats()
+        print("Pool finished at " + datetime.now().strftime("%H:%M:%S") + ": " +
+              ", ".join(k + "=" + str(v) for k, v in st.items()))
+        if self.tracker.failed:
+            print("No PHASCII from steps: " + str(sorted(self.tracker.failed)))
+        return st
+
+
+# Popen-like handle for several commands run one after another, e.g. step then export PHASCII.
+# wait() runs the rest of the chain, so call it from the tracker's watcher thread.
+class ChainedProcess(object):
+    def __init__(self, argvs, cwd=None):
+        self.argvs = list(argvs)
+        self.cwd = cwd
+        self.lock = threading.Lock()
+        self.killed = False
+        self.returncode = None
+        self.proc = self.start(self.argvs.pop(0))
+
+    def start(self, argv):
+        return subprocess.Popen(argv, cwd=self.cwd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+
+    def wait(self):
+        while True:
+            rc = self.proc.wait()
+            with self.lock:
+                # Stop the chain at the first failure.
+                if rc != 0 or self.killed or not self.argvs:
+                    self.returncode = rc
+                    return rc
+                self.proc = self.start(self.argvs.pop(0))
+
+    def poll(self):
+        return self.returncode
+
+    def kill(self):
+        with self.lock:
+            self.killed = True
+            self.proc.kill()
+
+
+# Builds the evolve_batch argument vectors in memory and runs them directly: no .bat per step.
+# evolve_exe may be a path or a list, e.g. [sys.executable, "evolve_standin.py"] for a stand-in.
+class ArgvLauncher(object):
+    def __init__(self, evolve_exe=None, cwd=None):
+        if evolve_exe is None:
+            evolve_exe = evolve_dirpath / "evolve_batch"
+        if isinstance(evolve_exe, (str, Path)):
+            evolve_exe = [evolve_exe]
+        self.prefix = [str(x) for x in evolve_exe]
+        # Run from the executable's own folder like the templates do, unless told otherwise.
+        if cwd is None and len(self.prefix) == 1 and Path(self.prefix[0]).parent.is_dir():
+            cwd = Path(self.prefix[0]).parent
+        self.cwd = cwd
+
+    # "evolve_batch s Nu in out": simulate N updates. 0u just converts, e.g. to PHASCII.
+    def argv(self, updates, in_path, out_path):
+        return self.prefix + ["s", str(updates) + "u", str(Path(in_path).resolve()), str(Path(out_path).resolve())]
+
+    # Same two commands as evo_template_01.bat.
+    def step_argvs(self, evin_path, evout_path, updates):
+        evout_path = Path(evout_path)
+        return [self.argv(updates, evin_path, evout_path.with_suffix(".evolve")),
+                self.argv(0, evout_path.with_suffix(".evolve"), evout_path.with_suffix(".txt"))]
+
+    def launch(self, evin_path, evout_path, updates):
+        return ChainedProcess(self.step_argvs(evin_path, evout_path, updates), self.cwd)
+
+    # PHASCII of an existing universe, e.g. the starting one.
+    def export(self, evin_path):
+        return ChainedProcess([self.argv(0, evin_path, Path(evin_path).with_suffix(".txt"))], self.cwd)
+
+
+
+# Bytes of snapshots that finished simulating but have not been scraped yet.
+# The pool stops launching while this is over max_bytes, so disk use tops out at max_bytes plus the steps
+# already in flight. The scraper releases each step when done with it.
+class SnapshotBudget(object):
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.held = {}
+        self.total = 0
+        self.peak = 0
+        self.cond = threading.Condition()
+
+    def add(self, step, paths):
+        size = sum(p.stat().st_size for p in paths if p.exists())
+        with self.cond:
+            self.total += size - self.held.get(step, 0)
+            self.held[step] = size
+            self.peak = max(self.peak, self.total)
+
+    def release(self, step):
+        with self.cond:
+            self.total -= self.held.pop(step, 0)
+            self.cond.notify_all()
+
+    def over(self):
+        return self.total > self.max_bytes
+
+    def wait_below(self, timeout=None):
+        with self.cond:
+            return self.cond.wait_for(lambda: self.total <= self.max_bytes, timeout)
+
+
+# Compress a snapshot that must be kept, e.g. every Nth step, and drop the original.
+def compress_snapshot(snap_path, preset=1):
+    snap_path = Path(snap_path)
+    if not snap_path.exists():
+        return None
+    xz_path = snap_path.with_name(snap_path.name + ".xz")
+    tmp_path = xz_path.with_name(xz_path.name + ".part")
+    tmp_path.write_bytes(lzma.compress(snap_path.read_bytes(), preset=preset))
+    os.replace(tmp_path, xz_path)
+    snap_path.unlink()
+    return xz_path
+
+
+def decompress_snapshot(xz_path):
+    xz_path = Path(xz_path)
+    snap_path = xz_path.with_name(xz_path.name[:-len(".xz")])
+    snap_path.write_bytes(lzma.decompress(xz_path.read_bytes()))
+    return snap_path
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Filename: binary_snapshot.py
+Date created: 2026/10/18, Sun, 15:30:00 (UTC+8)
+@author: LioHong
+Purpose: Compact binary snapshots (.evsnap) to keep instead of PHASCII text, readable straight from a memory map.
+Steps:
+1. Parse the PHASCII once with phascii_reader.Universe.
+2. Store the header, organism/spore/cell/organic/barrier tables and integer-encoded programs as contiguous arrays.
+3. Read them back as NumPy views over a memory map: no parsing, nothing copied until used.
+
+Layout: 8-byte magic, uint32 length of a JSON directory, the directory, then each array aligned to 64 bytes.
+The directory holds the format version, the UNIVERSE header, the program vocabulary and each array's dtype/shape/offset.
+"""
+import json
+import mmap
+import struct
+from pathlib import Path
+import numpy as np
+import phascii_reader as phre
+
+snap_magic = b"EVSNAP\x00\x01"
+snap_version = 1
+snap_align = 64
+organism_cols = ["ID", "STRAIN", "OFLAGS", "PARENT1", "PARENT2", "GENERATION", "ENERGY", "AGE"]
+spore_cols = ["X", "Y", "ENERGY", "PARENT", "STRAIN", "SFLAGS"]
+
+
+def is_number(token):
+    return token.lstrip("-").isdigit()
+
+
+# Programs of all organisms then all spores, flattened into one integer per token.
+# Numbers are stored as themselves and words as word_base + their vocab index, word_base being one past the largest number.
+def encode_programs(programs):
+    vocab = sorted({t for program in programs for t in program if not is_number(t)})
+    vocab_idx = {t: i for i, t in enumerate(vocab)}
+    numbers = [int(t) for program in programs for t in program if is_number(t)]
+    word_base = max(numbers, default=0) + 1
+    offsets = np.zeros(len(programs) + 1, dtype=np.int64)
+    tokens = []
+    for i, program in enumerate(programs):
+        tokens.extend(int(t) if is_number(t) else word_base + vocab_idx[t] for t in program)
+        offsets[i+1] = len(tokens)
+    # KFORTH literals are small, so this is usually int16.
+    dtype = np.int16 if min(numbers, default=0) >= -2**15 and word_base + len(vocab) < 2**15 else np.int32
+    return vocab, word_base, offsets, np.array(tokens, dtype=dtype)
+
+
+def write_snapshot(phas_path, snap_path=None):
+    phas_path = Path(phas_path)
+    snap_path = phas_path.with_suffix(".evsnap") if snap_path is None else Path(snap_path)
+    with phre.Universe(phas_path) as univ:
+        organisms, spores = univ.organisms, univ.spores
+        vocab, word_base, offsets, tokens = encode_programs([org.program for org in organisms] +
+                                                        [sp.program for sp in spores])
+        arrays = {
+            "organisms": np.array([[getattr(org, c) for c in ["id", "strain", "oflags", "parent1", "parent2",
+                                                             "generation", "energy", "age"]] for org in organisms],
+                                  dtype=np.int32).reshape(-1, len(organism_cols)),
+            "spores": np.array([[sp.x, sp.y, sp.energy, sp.parent, sp.strain, sp.sflags] for sp in spores],
+                               dtype=np.int32).reshape(-1, len(spore_cols)),
+            "cells": np.array([[c.organism_id, c.x, c.y] for c in univ.cells], dtype=np.int32).reshape(-1, 3),
+            "organics": np.array([[o.x, o.y, o.energy] for o in univ.organics], dtype=np.int32).reshape(-1, 3),
+            "barriers": np.array([[b.x, b.y] for b in univ.barriers], dtype=np.int32).reshape(-1, 2),
+            "program_offsets": offsets,
+            "program_tokens": tokens,
+        }
+        header = univ.header
+    directory = {"version": snap_version, "universe": header, "vocab": vocab, "word_base": word_base, "arrays": {}}
+    offset = 0
+    for name, arr in arrays.items():
+        directory["arrays"][name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+        offset += -(-arr.nbytes // snap_align) * snap_align
+    dir_bytes = json.dumps(directory).encode("utf-8")
+    head_len = len(snap_magic) + 4 + len(dir_bytes)
+    data_start = -(-head_len // snap_align) * snap_align
+    # Write under a temporary name first so readers never see half a snapshot.
+    tmp_path = snap_path.with_name(snap_path.name + ".part")
+    with open(tmp_path, "wb") as f:
+        f.write(snap_magic + struct.pack("<I", len(dir_bytes)) + dir_bytes)
+        f.write(b"\0" * (data_start - head_len))
+        for name, arr in arrays.items():
+            f.write(np.ascontiguousarray(arr).tobytes())
+            f.write(b"\0" * (-arr.nbytes % snap_align))
+    tmp_path.replace(snap_path)
+    return snap_path
+
+
+# Read-only view of an .evsnap. Every table is a NumPy array over the memory map.
+class BinarySnapshot(object):
+    def __init__(self, snap_path):
+        self.snap_path = Path(snap_path)
+        with open(self.snap_path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(snap_magic)] != snap_magic:
+            self.mm.close()
+            raise ValueError("Not an EVSNAP file: " + str(self.snap_path))
+        dir_len = struct.unpack_from("<I", self.mm, len(snap_magic))[0]
+        head_len = len(snap_magic) + 4 + dir_len
+        directory = json.loads(self.mm[len(snap_magic) + 4:head_len].decode("utf-8"))
+        if directory["version"] > snap_version:
+            self.mm.close()
+            raise ValueError("EVSNAP version " + str(directory["version"]) + " is newer than this reader.")
+        self.header = directory["universe"]
+        self.vocab = directory["vocab"]
+        self.word_base = directory["word_base"]
+        data_start = -(-head_len // snap_align) * snap_align
+        self.arrays = {}
+        for name, spec in directory["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            count = int(np.prod(spec["shape"]))
+            self.arrays[name] = np.frombuffer(self.mm, dtype=dtype, count=count,
+                                              offset=data_start + spec["offset"]).reshape(spec["shape"])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Drop the array views first, else the map cannot be closed.
+    def close(self):
+        self.arrays = {}
+        self.mm.close()
+
+    @property
+    def organisms(self):
+        return self.arrays["organisms"]
+
+    @property
+    def spores(self):
+        return self.arrays["spores"]
+
+    @property
+    def cells(self):
+        return self.arrays["cells"]
+
+    # Book-of-life keys, "id p1 p2 gen", in file order.
+    def vital_stats(self):
+        return [str(o[0]) + " " + str(o[3]) + " " + str(o[4]) + " " + str(o[5]) for o in self.organisms.tolist()]
+
+    # KFORTH tokens of the n-th program: organisms first, then spores.
+    def program(self, n):
+        lo, hi = self.arrays["program_offsets"][n:n+2]
+        word_base = self.word_base
+        return [str(t) if t < word_base else self.vocab[t - word_base]
+                for t in self.arrays["program_tokens"][lo:hi].tolist()]
+
+    def organism_program(self, n):
+        return self.program(n)
+
+    def spore_program(self, n):
+        return self.program(len(self.organisms) + n)
+
+    # Same grids as phascii_reader.Universe.occupancy().
+    def occupancy(self):
+        height, width = self.header["HEIGHT"], self.header["WIDTH"]
+        orgid = np.zeros((height, width), dtype=np.int32)
+        food = np.zeros((height, width), dtype=np.int32)
+        barrier = np.zeros((height, width), dtype=bool)
+        cells, organics, barriers = self.cells, self.arrays["organics"], self.arrays["barriers"]
+        orgid[cells[:, 2], cells[:, 1]] = cells[:, 0]
+        food[organics[:, 1], organics[:, 0]] = organics[:, 2]
+        barrier[barriers[:, 1], barriers[:, 0]] = True
+        return {"orgid": orgid, "food": food, "barrier": barrier}
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+Filename: book_keeper.py
+Date created: 2026/10/18, Sun, 16:10:00 (UTC+8)
+@author: LioHong
+Purpose: Columnar book of life: one typed array per field instead of a dict of "id p1 p2 gen": [birth, death] lists.
+Steps:
+1. Append each newborn's ID, sporelayer, quickener, generation and birth-step to the end of the columns.
+2. Find an organism's row in O(1) through a dense ID -> row array, since Evolve hands out IDs in sequence.
+3. Fill in death-steps in place. Living organisms have a death-step of -1.
+4. Hand the filled part of the columns to pandas without copying.
+5. Stream "key:value" records to the book and genome files while the run goes, then sort them by ID at the end.
+6. Load a book file back into typed columns in one pass, cached in an .npz sidecar while the file is unchanged.
+7. Merge the record files of consecutive runs by ID in one streaming pass, the later run winning.
+
+Both the columns and the ID array double when full, so appends are amortised O(1).
+"""
+import re
+import heapq
+from itertools import islice
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+book_cols = ["ID", "Sporelayer", "Quickener", "Generation", "Birth_step", "Death_step"]
+# Evolve keeps IDs and step counts in 32-bit ints.
+book_dtypes = [np.int32] * 6
+# Death-step of an organism that is still alive.
+alive = -1
+
+
+def org_id(vital_stats):
+    return vital_stats if isinstance(vital_stats, (int, np.integer)) else int(vital_stats.split(" ", 1)[0])
+
+
+# Drop-in for the old dict where the scraper needs it: keys are still vital_stats or plain IDs,
+# and items() gives back "id p1 p2 gen" with [birth] or [birth, death], so glue_book() writes the same file.
+class BookOfLife(object):
+    def __init__(self, capacity=1024):
+        self.cols = [np.empty(capacity, dtype=dt) for dt in book_dtypes]
+        self.n = 0
+        # rows[id - base] is the row of that ID, or -1 if it is not in the book.
+        self.base = None
+        self.rows = np.empty(0, dtype=np.int32)
+
+    def __len__(self):
+        return self.n
+
+    def __contains__(self, vital_stats):
+        return self.row(vital_stats) >= 0
+
+    def clear(self):
+        self.n = 0
+        self.base = None
+        self.rows = np.empty(0, dtype=np.int32)
+
+    def row(self, vital_stats):
+        if self.base is None:
+            return -1
+        i = org_id(vital_stats) - self.base
+        if i < 0 or i >= len(self.rows):
+            return -1
+        return int(self.rows[i])
+
+    # Like row(), but the organism has to be in the book.
+    def find(self, vital_stats):
+        r = self.row(vital_stats)
+        if r < 0:
+            raise KeyError(vital_stats)
+        return r
+
+    # Widen the ID array to take oid, doubling so that runs of new IDs cost O(1) each.
+    def cover(self, oid):
+        if self.base is None:
+            self.base = oid
+            self.rows = np.full(1024, -1, dtype=np.int32)
+        elif oid < self.base:
+            grow = max(self.base - oid, len(self.rows))
+            self.rows = np.concatenate([np.full(grow, -1, dtype=np.int32), self.rows])
+            self.base -= grow
+        elif oid - self.base >= len(self.rows):
+            grow = max(oid - self.base + 1 - len(self.rows), len(self.rows))
+            self.rows = np.concatenate([self.rows, np.full(grow, -1, dtype=np.int32)])
+
+    # New organism from its vital_stats "id p1 p2 gen". Returns its row.
+    def add(self, vital_stats, birth_step):
+        oid, p1, p2, gen = [int(x) for x in vital_stats.split(" ")]
+        if self.n == len(self.cols[0]):
+            self.cols = [np.concatenate([col, np.empty(len(col), dtype=col.dtype)]) for col in self.cols]
+        r = self.n
+        for col, value in zip(self.cols, (oid, p1, p2, gen, birth_step, alive)):
+            col[r] = value
+        self.cover(oid)
+        self.rows[oid - self.base] = r
+        self.n += 1
+        return r
+
+    def set_death(self, vital_stats, death_step):
+        self.cols[5][self.find(vital_stats)] = death_step
+
+    def is_alive(self, vital_stats):
+        return self.cols[5][self.find(vital_stats)] == alive
+
+    # [birth] or [birth, death], as in the old dict.
+    def life(self, vital_stats):
+        r = self.find(vital_stats)
+        birth, death = int(self.cols[4][r]), int(self.cols[5][r])
+        return [birth] if death == alive else [birth, death]
+
+    def vital_stats(self, r):
+        return " ".join(str(int(col[r])) for col in self.cols[:4])
+
+    # vital_stats of everyone not yet dead, in the order they were added.
+    def living(self):
+        return [self.vital_stats(r) for r in np.flatnonzero(self.cols[5][:self.n] == alive)]
+
+    def items(self):
+        ids, p1s, p2s, gens, births, deaths = [col[:self.n].tolist() for col in self.cols]
+        for oid, p1, p2, gen, birth, death in zip(ids, p1s, p2s, gens, births, deaths):
+            yield (str(oid) + " " + str(p1) + " " + str(p2) + " " + str(gen),
+                   [birth] if death == alive else [birth, death])
+
+    # Views of the columns, so nothing is copied. Deaths filled in later show through;
+    # rows added later do not, and once the columns grow the frame keeps the old buffers.
+    def to_frame(self):
+        index = pd.Index(self.cols[0][:self.n], name=book_cols[0], copy=False)
+        return pd.DataFrame({c: col[:self.n] for c, col in zip(book_cols[1:], self.cols[1:])}, index=index,
+                            copy=False)
+
+    def nbytes(self):
+        return sum(col.nbytes for col in self.cols) + self.rows.nbytes
+
+
+# Appends "key:value" lines in glue_book()'s format, so the file is readable at any point of the run.
+class RecordWriter(object):
+    def __init__(self, path):
+        self.path = Path(path)
+        self.f = open(self.path, "w", encoding="utf-8")
+
+    def write(self, key, value):
+        self.f.write("%s:%s\n" % (key, value))
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+def line_id(line):
+    return int(line.split(" ", 1)[0])
+
+
+# Sort a record file by organism ID in place. Sorted runs of chunk_lines lines go to temporary files
+# and are merged back, so only one chunk is ever held in memory.
+def compact_by_id(path, chunk_lines=200000):
+    path = Path(path)
+    runs = []
+    with open(path, encoding="utf-8") as f:
+        while True:
+            chunk = list(islice(f, chunk_lines))
+            if not chunk:
+                break
+            # The last line of the file may lack its newline, and would be glued to the next after sorting.
+            if not chunk[-1].endswith("\n"):
+                chunk[-1] += "\n"
+            chunk.sort(key=line_id)
+            run_path = path.with_name(path.name + ".run" + str(len(runs)))
+            run_path.write_text("".join(chunk), encoding="utf-8")
+            runs.append(run_path)
+    tmp_path = path.with_name(path.name + ".part")
+    run_files = [open(run_path, encoding="utf-8") for run_path in runs]
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as out:
+            out.writelines(heapq.merge(*run_files, key=line_id))
+    finally:
+        for run_file in run_files:
+            run_file.close()
+    tmp_path.replace(path)
+    for run_path in runs:
+        run_path.unlink()
+    return path
+
+
+# Separators of "id p1 p2 gen:[birth, death]" that become spaces, leaving six numbers per line.
+book_seps = str.maketrans(":[],", "    ")
+# Living organisms have no death-step yet: "...:[birth]".
+book_living = re.compile(r"\[(-?\d+)\]")
+
+
+# Columns of a book_of_life text file in file order, as {book_cols name: int64 array}.
+# Living organisms get a death-step of living_death (0 in organise_book_of_life, so their lifespan is negative).
+def parse_book(book_path, living_death=0):
+    text = Path(book_path).read_text(encoding="utf-8")
+    text = book_living.sub(r"\1 " + str(living_death), text).translate(book_seps)
+    numbers = np.fromstring(text, dtype=np.int64, sep=" ")
+    if len(numbers) % len(book_cols):
+        raise ValueError("Malformed book of life: " + str(book_path))
+    table = numbers.reshape(-1, len(book_cols))
+    return {c: np.ascontiguousarray(table[:, i]) for i, c in enumerate(book_cols)}
+
+
+# parse_book(), but reusing <book>.npz while the text file has the same size and mtime as when it was cached.
+def load_book(book_path, living_death=0):
+    book_path = Path(book_path)
+    sidecar_path = book_path.with_suffix(".npz")
+    st = book_path.stat()
+    stamp = np.array([st.st_mtime_ns, st.st_size, living_death], dtype=np.int64)
+    if sidecar_path.exists():
+        with np.load(sidecar_path) as cached:
+            if np.array_equal(cached["stamp"], stamp):
+                return {c: cached[c] for c in book_cols}
+    cols = parse_book(book_path, living_death)
+    try:
+        # Via a temporary name, so a half-written sidecar is never read. np.savez adds .npz to the name.
+        tmp_path = sidecar_path.with_name(sidecar_path.stem + ".part")
+        np.savez(tmp_path, stamp=stamp, **cols)
+        tmp_path.with_name(tmp_path.name + ".npz").replace(sidecar_path)
+    except OSError as e:
+        print("Book sidecar not saved: " + str(e))
+    return cols
+
+
+def sorted_by_id(path):
+    last = None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            oid = line_id(line)
+            if last is not None and oid < last:
+                return False
+            last = oid
+    return True
+
+
+def keyed_lines(f, rank):
+    for line in f:
+        # The last line of a file may lack its newline.
+        yield (line_id(line), rank), line if line.endswith("\n") else line + "\n"
+
+
+# k-way merge of record files into out_path, ordered by ID. paths go from highest priority down:
+# when several files have the same ID, the line from the earliest path is kept.
+# Files not yet sorted by ID (e.g. books from before they were compacted) are sorted in a temporary copy.
+def merge_by_id(paths, out_path):
+    out_path = Path(out_path)
+    sources, temps = [], []
+    for path in paths:
+        path = Path(path)
+        if not sorted_by_id(path):
+            tmp_copy = out_path.with_name(out_path.name + ".sort" + str(len(temps)))
+            tmp_copy.write_bytes(path.read_bytes())
+            temps.append(compact_by_id(tmp_copy))
+            path = tmp_copy
+        sources.append(path)
+    files = [open(path, encoding="utf-8") for path in sources]
+    written = 0
+    last = None
+    tmp_path = out_path.with_name(out_path.name + ".part")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as out:
+            for (oid, rank), line in heapq.merge(*[keyed_lines(f, rank) for rank, f in enumerate(files)]):
+                if oid != last:
+                    out.write(line)
+                    written += 1
+                    last = oid
+    finally:
+        for f in files:
+            f.close()
+        for tmp_copy in temps:
+            tmp_copy.unlink()
+    tmp_path.replace(out_path)
+    return written
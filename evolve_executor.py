@@ -14,16 +14,30 @@ Steps:
 """
 # from os import system
 import subprocess
+import queue
+import threading
+import multiprocessing
 from shutil import copyfile
 from pathlib import Path
 from math import log10
 from datetime import datetime
+from json import dumps, loads
+import os
 import pandas as pd
-from numpy import array_split
+from functools import partial
+from bisect import bisect_left
+from itertools import repeat
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 # This is a borrowed algorithm.
 import GlobalAlignment
 import genome_handler as geha
 import track_phylogeny as tphy
+import batch_runner as baru
+import phascii_reader as phre
+import work_queue as wq
+import binary_snapshot as bisn
+import book_keeper as bkpr
 
 from time import sleep
 
@@ -35,7 +49,10 @@ pd.set_option('display.expand_frame_repr', False)
 
 # ===== PATHS =====
 # Edit a BATCH file to run the input and output Evolve files.
+# Only used by the "bat" launcher, kept for compatibility.
 bat_tmpl_path = Path(".") / "evo_template.bat"
+# Called directly by the "argv" launcher. Swap in a stand-in (path or argv list) on Linux.
+evolve_exe = baru.evolve_dirpath / "evolve_batch"
 # Eventually can adjust based on user input.
 grp_num =  "002"
 run_num = "047"
@@ -50,11 +67,34 @@ book_path = run_dirpath / ("book_of_life_" + run_num + ".txt")
 bgen_path = run_dirpath / ("bgen_" + run_num + ".csv")
 cgen_path = run_dirpath / ("cgen_" + run_num + ".csv")
 cgd_path = run_dirpath / ("cgd_" + run_num + ".csv")
+spore_path = run_dirpath / ("spore_ledger_" + run_num + ".csv")
 # All genomes present per timestep.
 genomes_over_time = {}
-# All genomes in the strain over time.
+# Genomes of the organisms alive at the last scraped step. Every genome ever seen is in the strain_genome file.
 strain_genome = {}
-book_of_life = {}
+# Columnar: see book_keeper.BookOfLife.
+book_of_life = bkpr.BookOfLife()
+# (x, y, parent, strain, genome_hash): [energy, sflags, first_step, last_step] of every spore seen.
+spore_ledger = {}
+spore_cols = ["X", "Y", "Parent", "Strain", "Genome_hash", "Energy", "Sflags", "First_step", "Last_step"]
+
+
+# Point the module at another run. The orchestrator calls this once per run, each in its own process.
+def set_run(grp, run, name):
+    global grp_num, run_num, run_name, grp_dirpath, run_dirpath
+    global strain_genome_path, book_path, bgen_path, cgen_path, cgd_path, spore_path
+    grp_num, run_num, run_name = grp, run, name
+    grp_dirpath = Path(".") / "Runs" / ("Grp_" + grp_num)
+    run_dirpath = grp_dirpath / ("Run_" + run_num)
+    strain_genome_path = run_dirpath / ("strain_genome_" + run_num + ".txt")
+    book_path = run_dirpath / ("book_of_life_" + run_num + ".txt")
+    bgen_path = run_dirpath / ("bgen_" + run_num + ".csv")
+    cgen_path = run_dirpath / ("cgen_" + run_num + ".csv")
+    cgd_path = run_dirpath / ("cgd_" + run_num + ".csv")
+    spore_path = run_dirpath / ("spore_ledger_" + run_num + ".csv")
+    strain_genome.clear()
+    book_of_life.clear()
+    spore_ledger.clear()
 
 
 def replace_old_with_new(text, old_new_dict):
@@ -100,12 +140,62 @@ def glue_book(input_path, data_dict):
     input_path.write_text("".join(lines), encoding="utf-8")
 
 
+# Spores have no ID, but one sits on its square until it is quickened.
+# So the same square, parent, strain and genome at a later step is the same spore.
+def ledger_spores(spores, timestep):
+    for x, y, energy, parent, strain, sflags, genome_hash in spores:
+        seen = spore_ledger.get((x, y, parent, strain, genome_hash))
+        if seen is None:
+            spore_ledger[(x, y, parent, strain, genome_hash)] = [energy, sflags, timestep, timestep]
+        else:
+            seen[0], seen[1], seen[3] = energy, sflags, timestep
+
+
+def glue_spores(input_path):
+    lines = [",".join(spore_cols) + "\n"]
+    for key, value in spore_ledger.items():
+        lines.append(",".join(str(x) for x in list(key) + value) + "\n")
+    input_path.write_text("".join(lines), encoding="utf-8")
+
+
+# Append-only journal of every scraped step: births with their genomes, and deaths.
+# Steps simulated but not scraped yet get a {"landed": step} line, so a resume can use their snapshots.
+# One JSON object per line, so a crash can at worst tear the last line.
+def load_journal(journal_path):
+    entries = []
+    for line in journal_path.read_text(encoding="utf-8").splitlines():
+        try:
+            entries.append(loads(line))
+        except ValueError:
+            print("Torn journal line dropped.")
+            break
+    return entries
+
+
+# Rebuild strain_genome and book_of_life from journal entries.
+def replay_journal(entries):
+    for entry in entries:
+        for vital_stats, aaff_string in entry["born"].items():
+            strain_genome[vital_stats] = aaff_string
+            if vital_stats not in book_of_life:
+                book_of_life.add(vital_stats, entry["t"])
+        for vital_stats, death_step in entry["died"].items():
+            if book_of_life.is_alive(vital_stats):
+                book_of_life.set_death(vital_stats, death_step)
+        ledger_spores(entry.get("spores", []), entry["t"])
+
+
+# Names of the output EVOLVE/PHASCII per step, without extensions.
+def step_names(start_step, time_period, interval):
+    return [run_name + "_" + str(start_step+x+1) for x in range(0,(time_period), interval)]
+
+
 # Pre-generate BAT files.
 # Expected max time_period = 100K (~20 MB).
 def pregen_batches(start_step, time_period, interval):
     bfnumbered = "run_" + run_num + "_" + run_name + "_evolve_STNM.bat"
     bfnames = [bfnumbered.replace("STNM", str(start_step+x+1)) for x in range(0,(time_period), interval)]
-    evoofnames = [run_name + "_" + str(start_step+x+1) for x in range(0,(time_period), interval)]
+    evoofnames = step_names(start_step, time_period, interval)
     bfpaths = [run_dirpath / bfn for bfn in bfnames]
     btmpl_text = bat_tmpl_path.read_text(encoding="utf-8").splitlines()
     evin_fname = run_name + "_" + str(start_step)
@@ -129,100 +219,192 @@ def pregen_batches(start_step, time_period, interval):
 import cProfile
 # # For future formatting of filenames.
 # num_lead_zeroes = int(log10(time_period)) + 1
-def simulate_universe(time_period, start_step=0, interval=1, delete=False, prep=False, speed=False):
+def simulate_universe(time_period, start_step=0, interval=1, delete=False, prep=False, speed=False, slots=None,
+                      pipeline=False, launcher="argv", adaptive=False, resume=False, budget=None,
+                      disk_budget=None, keep_every=None, scrapers=None, delta=False, cube_every=None,
+                      skip_quiet=False, keep_binary=False):
     pr = cProfile.Profile()
     pr.enable()
-    # Split and tidy biodata from a single organism.
-    def wrangle_biodata(indiv_biodata):
-        # Save the stats of the organism while removing from genome.
-        vital_stats = indiv_biodata.pop(0)
-        # Convert indiv_biodata from a list of keywords into a single string.
-        indiv_biodata = ' '.join(indiv_biodata)
-        # Change of spacer: Convert tabs to spaces.
-        indiv_biodata = indiv_biodata.replace("    ", " ")
-        # Remove multiple spaces.
-        while "  " in indiv_biodata:
-            indiv_biodata = indiv_biodata.replace("  ", " ")
-        # Split into separate instructions and nums using single spaces for translation of keywords only.
-        indiv_biodata = indiv_biodata.split(" ")
-        # Remove blank strings.
-        # type(indiv_biodata) = list.
-        while '' in indiv_biodata:
-            indiv_biodata.remove('')
-        aaff_genome = geha.shrink_kforth_to_aaff(indiv_biodata)
-        aaff_string = geha.store_aaff(aaff_genome)
-        # Remove ENERGY and AGE from vital_stats.
-        vs_list = vital_stats.split(" ")
-        vital_stats = vs_list[1] + " " + " ".join(vs_list[4:7])
-        # Can just keep adding genome repeatedly and it'll overwrite.
-        popn_genome[vital_stats] = aaff_string
-        strain_genome[vital_stats] = aaff_string
-        return vital_stats, aaff_string, list(popn_genome.keys())
-
+    # Queue every step. Steps are keyed by the number in their PHASCII name.
+    def submit_all(pool):
+        evin_path = run_dirpath / (run_name + "_" + str(start_step) + ".evolve")
+        for idx, evoofn in enumerate(evoofnames):
+            if int(evoofn.split('_')[-1]) in reuse:
+                continue
+            if launcher == "bat":
+                # Closed stdin lets the "pause" at the end of the template return immediately.
+                launch = partial(subprocess.Popen, str(bfpaths[idx]), stdin=subprocess.DEVNULL)
+            else:
+                # Same update count that pregen_batches() writes into the BAT file.
+                launch = partial(argv_launcher.launch, evin_path, run_dirpath / evoofn, (idx+1)*interval)
+            pool.submit(int(evoofn.split('_')[-1]), run_dirpath / (evoofn + ".txt"), launch)
 
     def bunch_run():
-        # User decides split_len.
-        split_len = 100
-        split_num = time_period // split_len
-        beefs = array_split(bfpaths,split_num)
-        # beefs = array_split(bfpaths,10)
-        bstart = 0
-        for beef in beefs:
-            pproc = []
+        # Keep `slots` batches running and launch the next step as soon as any of them finishes.
+        pool = baru.LaunchPool(slots, budget=budget)
+        print("Pool of " + str(pool.slots) + " started at " + datetime.now().strftime("%H:%M:%S"))
+        submit_all(pool)
+        try:
+            for step in pool.as_completed():
+                if step not in pool.tracker.failed:
+                    journal_landed(step)
+        except Exception as e:
+            print('Popen stopped prematurely due to ' + str(e))
+        # Check if all EVOLVE/PHASCII pairs are generated. (Base off PHASCII only first.)
+        print("Popen finished at " + datetime.now().strftime("%H:%M:%S"))
+        # Steps with a PHASCII: failed ones and any never launched after an error have none.
+        return set(pool.tracker.done) | reuse, pool.report()
+
+    # Producer/consumer: the pool runs in a thread and hands over each step as its PHASCII lands,
+    # while this thread scrapes them. Steps are scraped strictly in order so death-steps stay correct.
+    def pipe_run():
+        pool = baru.LaunchPool(slots, budget=budget, snapshots=snapshots)
+        print("Pipeline of " + str(pool.slots) + " started at " + datetime.now().strftime("%H:%M:%S"))
+        submit_all(pool)
+        landed = queue.Queue()
+        # Steps already simulated before a resume land straight away.
+        for step in sorted(reuse):
+            landed.put(step)
+
+        def produce():
             try:
-                # print("Bunch #" + str(beefs.index(beef)) + " of " + str(split_num) +
-                #       " started at " + datetime.now().strftime("%H:%M:%S"))
-                print("Bunch started at " + datetime.now().strftime("%H:%M:%S"))
-                for brp in beef:
-                    pproc.append(subprocess.Popen(str(brp)))
-                flag = True
-                count = 0
-                while flag:
-                    data_files = [dfile for dfile in run_dirpath.glob('*')]
-
-                    # dbat_files = [db for db in data_files if '.bat' in str(db)]
-                    # dphs_files = [dp for dp in data_files if '.txt' in str(dp)]
-                    # db_nums = [str(dbn).split('.')[0].split('_')[-1] for dbn in dbat_files[bstart:bstart + len(beef)]]
-                    # dp_nums = [str(dpn).split('.')[0].split('_')[-1] for dpn in dphs_files[bstart:]]
-
-                    dbat_files = [db for db in data_files if '.bat' in str(db)]
-                    db_nums = [str(dbn).split('.')[0].split('_')[-1] for dbn in dbat_files]
-                    db_nums = [int(dbn) for dbn in db_nums]
-                    db_nums.sort()
-                    db_nums = db_nums[bstart:bstart+len(beef)]
-
-                    dphs_files = [dp for dp in data_files if '.txt' in str(dp)]
-                    dp_nums = [str(dpn).split('.')[0].split('_')[-1] for dpn in dphs_files]
-                    dp_nums = [int(dpn) for dpn in dp_nums]
-                    dp_nums.sort()
-                    dp_nums = dp_nums[bstart:]
-                    # if int(dp_nums[0]) == start_step:
-                    #     dp_nums.append(str(dphs_files[-1]).split('.')[0].split('_')[-1])
-                    gones = [dbn for dbn in db_nums if dbn not in dp_nums]
-                    count += 1
-                    # print(gones)
-                    if not gones:
-                        flag = False
-                        bstart += len(beef)
-                        print("Bstart: " + str(bstart))
-                print("Count: " + str(count))
-                for pp in pproc: pp.kill()
-            # Must kill these spare processes to prevent memory leak.
+                for step in pool.as_completed():
+                    # A step killed by stop() may have left half a PHASCII.
+                    if step not in pool.tracker.failed and not pool.stopped:
+                        journal_landed(step)
+                    landed.put(step)
             except Exception as e:
-                for pp in pproc: pp.kill()
                 print('Popen stopped prematurely due to ' + str(e))
-        # Check if all EVOLVE/PHASCII pairs are generated. (Base off PHASCII only first.)
+            finally:
+                landed.put(None)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        # Steps that landed but whose turn has not come yet, and their parses under way.
+        ready = set()
+        parsing = {}
+        # With skip_quiet, the UNIVERSE counters of landed steps: a step with the same counters as the one
+        # before it is quiet, and scrape_step will not parse it, so it is not sent to the workers either.
+        quiet_check = skip_quiet and not cube_every
+        landed_counts = {}
+        step_order = [int(evoofn.split('_')[-1]) for evoofn in evoofnames]
+        prev_steps = dict(zip(step_order, [start_step] + step_order))
+        next_steps = dict(zip(step_order, step_order[1:]))
+
+        # Start parsing as soon as it lands; the book is still updated strictly in order below.
+        def parse_ahead(step):
+            if scrape_pool is None or step in parsing or step in pool.tracker.failed:
+                return
+            if quiet_check:
+                # Decided once the step before it has landed too. Unknown until then, or if that one failed.
+                prev = prev_steps[step]
+                if step not in landed_counts or prev not in landed_counts:
+                    return
+                if landed_counts[prev] == landed_counts[step]:
+                    return
+            parsing[step] = scrape_pool.submit(geha.scrape_snapshot,
+                                               run_dirpath / (run_name + "_" + str(step) + ".txt"),
+                                               None, bool(cube_every))
+        timesteps = iter(range(start_step, start_step+time_period, interval))
+        timestep = next(timesteps, None)
+        try:
+            while timestep is not None:
+                step = landed.get()
+                if step is None:
+                    print("Producer stopped before step " + str(timestep))
+                    break
+                ready.add(step)
+                if quiet_check and scrape_pool is not None and step not in pool.tracker.failed:
+                    landed_counts[step] = phre.universe_counts(run_dirpath / (run_name + "_" + str(step) + ".txt"))
+                    if next_steps.get(step) in ready:
+                        parse_ahead(next_steps[step])
+                parse_ahead(step)
+                while timestep is not None:
+                    step = int(evoofnames[(timestep-start_step)//interval].split('_')[-1])
+                    if step not in ready:
+                        break
+                    ready.discard(step)
+                    # Its successor has been decided by now, or will be from its own counters.
+                    landed_counts.pop(prev_steps[step], None)
+                    if step in pool.tracker.failed:
+                        print("No PHASCII for step " + str(step) + ", skipping.")
+                        if snapshots is not None:
+                            snapshots.release(step)
+                    elif step in parsing:
+                        scrape_step(timestep, parsed=parsing.pop(step).result())
+                    else:
+                        scrape_step(timestep)
+                    timestep = next(timesteps, None)
+        finally:
+            # Also on a scrape error: launch nothing more and let the producer run out.
+            pool.stop()
+            producer.join()
         print("Popen finished at " + datetime.now().strftime("%H:%M:%S"))
-
-    # Performance metric.
-    print("Scraper started at " + datetime.now().strftime("%H:%M:%S"))
-    # Copy EVOLVE and PHASCII from template.
-    if prep: prep_new_run()
-    bfpaths, evoofnames = pregen_batches(start_step, time_period, interval)
-    bunch_run()
-    lives_output = ""
-    # evin_fname = run_name + "_" + str(start_step)
-    for timestep in range(start_step, start_step+time_period, interval):
+        if snapshots is not None:
+            print("Peak unscraped snapshot bytes: " + str(snapshots.peak))
+        return pool.report()
+
+    # Coarse jumps of `interval`, bisected down to single steps only inside windows where the
+    # UNIVERSE counters (NEXT_ID, NBORN, NDIE) changed. Quiet windows have no births or deaths,
+    # so scraping the steps that were run still gives exact birth- and death-steps.
+    def adaptive_run():
+        pool = baru.LaunchPool(slots, budget=budget)
+        print("Adaptive pool of " + str(pool.slots) + " started at " + datetime.now().strftime("%H:%M:%S"))
+        end_step = start_step + time_period
+        evin_path = run_dirpath / (run_name + "_" + str(start_step) + ".evolve")
+        # Sorted steps submitted so far, and header counters of those that finished.
+        steps = [start_step]
+        counts = {}
+
+        def submit(step):
+            i = bisect_left(steps, step)
+            if i < len(steps) and steps[i] == step:
+                return
+            steps.insert(i, step)
+            if step in reuse:
+                finished(step)
+            else:
+                pool.submit(step, run_dirpath / (run_name + "_" + str(step) + ".txt"),
+                            partial(argv_launcher.launch, evin_path, run_dirpath / (run_name + "_" + str(step)),
+                                    step - start_step))
+
+        # Read the counters of a finished step and bisect the windows next to it where they changed.
+        def finished(step):
+            if step in pool.tracker.failed:
+                # Unknown counters: bisect the windows on either side to be safe.
+                print("No PHASCII for step " + str(step) + ", bisecting around it.")
+                counts[step] = None
+            else:
+                counts[step] = phre.universe_counts(run_dirpath / (run_name + "_" + str(step) + ".txt"))
+            # Only neighbours among submitted steps count, so pending coarse steps are not bisected twice.
+            i = bisect_left(steps, step)
+            for left, right in [(steps[i-1] if i > 0 else None, step),
+                                (step, steps[i+1] if i+1 < len(steps) else None)]:
+                if left is None or right is None or left not in counts or right not in counts:
+                    continue
+                if right - left > 1 and (counts[left] is None or counts[left] != counts[right]):
+                    submit((left + right) // 2)
+
+        # start_step+1 is always run: it is scraped as timestep start_step, so the organisms alive at
+        # the start get that birth-step, as in an every-step run, even if the first window is quiet.
+        for step in [start_step+1] + list(range(start_step+interval, end_step, interval)) + [end_step]:
+            submit(step)
+        for step in pool.as_completed():
+            if step not in pool.tracker.failed:
+                journal_landed(step)
+            finished(step)
+        print("Steps run: " + str(len(steps) - 1) + " of " + str(time_period))
+        return [step for step in steps if counts.get(step) and step != start_step], pool.report()
+
+    # The step's PHASCII and EVOLVE are complete, though not scraped yet. Called from pipe_run's producer too.
+    def journal_landed(step):
+        with journal_lock:
+            journal.write(dumps({"landed": step}) + "\n")
+            journal.flush()
+
+    # parsed: scrape_snapshot() of the PHASCII if it was already parsed, e.g. in a scraper process.
+    def scrape_step(timestep, phas_path=None, parsed=None):
+        nonlocal delete, journal_count, stale_evolve, last_counts
         # Progress update. Adjust the frequency if time_period becomes larger?
         if (timestep-start_step) % (max(time_period//100,1)) == 0:
             print(timestep)
@@ -230,67 +412,59 @@ def simulate_universe(time_period, start_step=0, interval=1, delete=False, prep=
 
         idx = int((timestep-start_step)/interval)
         # Export PHASCII for output: Extract only the ORGANIC section from the PHASCII.
-        phas_path = run_dirpath / (evoofnames[idx] + ".txt")
+        if phas_path is None:
+            phas_path = run_dirpath / (evoofnames[idx] + ".txt")
         # sleep(0.075)
+        # What this step added to the book, for the journal.
+        born, died, spores = {}, {}, []
         if not speed:
-            # Find the 'ORGANIC' entry and then slice the lines list.
-            phas = phas_path.read_text(encoding="utf-8").splitlines()
-            phas = phas[phas.index("ORGANIC {"):]
-            # Replace everything in indiv_biodata that's not a keyword.
-            # removables = ["\t", "\n", ":", "{", "}", "# program", '"']
-            # for rmvb in removables: phas = [r.replace(rmvb, "") for r in phas]
-            phas = [r.replace("\t","").replace(r"\n","").replace(r":","").replace(r"{","")\
-                     .replace(r"}","").replace(r"# program","").replace(r'"',"") for r in phas]
-            # Update instructions in genome to avoid collisions during genome handling step.
-            fix_collisions_dict = {"MAKE-SPORE": "MAKE-SPOR", " - ": " ~ ", "NUM-CELLS": "NUM-CELS"}
-            phas = replace_old_with_new(phas, fix_collisions_dict)
-            # for ph in phas:
-            #     ph = ph.replace(r"MAKE-SPORE","MAKE-SPOR").replace(r" - "," ~ ").replace(r"NUM-CELLS","NUM-CELS")
-
-            # Extract genomes of all organisms in universe.
-            org_flag = False
-            # Needed for death-step. Actually just need to copy orgids per timestep.
-            popn_genome = {}
-            organisms_in_timestep = []
-            # When see "ORGANISM", start recording the genome.
-            for phline in phas:
-                if "ORGANISM" in phline:
-                    org_flag = True
-                    indiv_biodata = []
-                # "CELL" indicates end of genome, so store collated biodata.
-                if "CELL" in phline and org_flag:
-                    org_flag = False
-                    vital_stats, indiv_biodata, population = wrangle_biodata(indiv_biodata)
+            # Fast path: the UNIVERSE line alone says whether anybody was born or died since the last snapshot.
+            counts = phre.universe_counts(phas_path) if skip_quiet and not cube_every else None
+            if counts is not None and counts == last_counts:
+                # Quiet step: the book stays as it is. Spores can be laid or eaten without moving
+                # the counters, so read them for real, skipping only the organisms and cells.
+                spores = geha.scrape_spores(phas_path)
+                ledger_spores(spores, timestep)
+            else:
+                # Needed for death-step. Actually just need to copy orgids per timestep.
+                popn_genome = {}
+                organisms_in_timestep = []
+                if parsed is None:
+                    # Delta: only newborns get their genome encoded, everyone else is already in strain_genome.
+                    parsed = geha.scrape_snapshot(phas_path, strain_genome if delta else None, bool(cube_every))
+                organisms, spores, occupancy = parsed
+                for vital_stats, aaff_string in organisms:
+                    if aaff_string is None:
+                        aaff_string = strain_genome[vital_stats]
+                    # Can just keep adding genome repeatedly and it'll overwrite.
+                    popn_genome[vital_stats] = aaff_string
+                    strain_genome[vital_stats] = aaff_string
                     # Add organism to list of living.
                     organisms_in_timestep.append(vital_stats)
                     # Add birth-step of organism.
                     if vital_stats not in book_of_life:
-                        book_of_life[vital_stats] = [timestep]
-                # Line-by-line, record the genome.
-                if org_flag:
-                    # Add line.
-                    indiv_biodata.append(phline)
-
-
-            # Add death-step of organism.
-            for vs_org in book_of_life:
-                # Check that organism was still alive.
-                if len(book_of_life[vs_org]) < 2:
-                    # Check that organism is no longer listed among living organisms.
-                    if vs_org not in population:
-                        # Add death-step. Subtract 1 to get final step while alive.
-                        book_of_life[vs_org].append(timestep-1)
-
-                # For spores, just find the lines between each index of spore, then the final entry.
-                # Or pop 1st spore, then find 2nd spore.
-                # Then slice the list up until 2nd spore.
-                # Repeat until last spore popped, leaving the final entry?
+                        book_of_life.add(vital_stats, timestep)
+                        born[vital_stats] = aaff_string
+                        genome_writer.write(vital_stats, aaff_string)
+                # Add death-step of organism: alive at the last scraped step but no longer listed among the living.
+                # Only the living are checked, not the whole book. Stays empty if the universe has gone extinct.
+                for vs_org in [vs for vs in living if vs not in popn_genome]:
+                    # Subtract 1 to get final step while alive.
+                    book_of_life.set_death(vs_org, timestep-1)
+                    died[vs_org] = timestep-1
+                    del living[vs_org]
+                    book_writer.write(vs_org, book_of_life.life(vs_org))
+                    strain_genome.pop(vs_org, None)
+                living.update(dict.fromkeys(born))
+                ledger_spores(spores, timestep)
+                if cube_every:
+                    cube.append((timestep, occupancy))
+                    if len(cube) >= cube_every:
+                        flush_cube()
+            last_counts = counts
 
             # # Add population genome to genome tracking over time.
             # genomes_over_time[timestep] = popn_genome
-            # Compare the ORGANISMS section of the input and output PHASCII files.
-            lives_output = geha.get_organics_from_universe(phas)
-            phas_path.write_text("\n".join(phas), encoding="utf-8")
             # # If the summaries are identical, then delete the output PHASCII (not lines in console).
             # if lives_input == lives_output and timestep != time_period:
             #     phas_path.unlink()
@@ -301,45 +475,215 @@ def simulate_universe(time_period, start_step=0, interval=1, delete=False, prep=
                 print('(Timestep-start_step) equal to time period.')
                 delete = False
 
+        step = int(phas_path.stem.split('_')[-1])
+        with journal_lock:
+            journal.write(dumps({"step": step, "t": timestep, "born": born, "died": died, "spores": spores}) + "\n")
+            journal.flush()
+        genome_writer.flush()
+        book_writer.flush()
+        # Flush to disk every so often so a crash loses at most about one old bunch of steps.
+        journal_count += 1
+        if journal_count % 100 == 0:
+            os.fsync(journal.fileno())
+        kept = bool(keep_every) and step % keep_every == 0
+        if kept:
+            # Keep every Nth snapshot, compressed in-line, or as an .evsnap that loads without parsing.
+            if keep_binary:
+                bisn.write_snapshot(phas_path)
+                phas_path.unlink()
+            else:
+                baru.compress_snapshot(phas_path)
+            baru.compress_snapshot(phas_path.with_suffix(".evolve"))
         # Operation: Delete the old PHASCII.
-        if delete:
+        elif delete:
             try: phas_path.unlink()
             except FileNotFoundError: print('FileNotFoundError but passing.')
+        if disk_budget:
+            # Only the newest EVOLVE is needed to resume, so drop the one before it.
+            if stale_evolve is not None:
+                stale_evolve.unlink(missing_ok=True)
+            stale_evolve = None if kept else phas_path.with_suffix(".evolve")
+            if snapshots is not None:
+                snapshots.release(step)
         # Operation: Delete the old batch file.
-        bfpaths[idx].unlink()
+        if bfpaths:
+            bfpaths[idx].unlink()
+
+    # Occupancy grids of the last few scraped steps, saved every cube_every steps as cube_<run>_<first step>.npz.
+    def flush_cube():
+        if cube:
+            phre.save_cube(run_dirpath / ("cube_" + run_num + "_" + str(cube[0][0]) + ".npz"),
+                           [t for t, g in cube], [g for t, g in cube])
+            cube.clear()
+
+    # scrape_snapshot() of each path in order, at most a few files ahead of the merge. None without a pool.
+    def scraped(phas_paths):
+        if scrape_pool is None:
+            yield from repeat(None, len(phas_paths))
+            return
+        ahead = deque()
+        prev_counts = None
+        for phas_path in phas_paths:
+            quiet = False
+            if skip_quiet and not cube_every:
+                # Quiet steps are skipped by scrape_step without parsing, so do not send them to the pool.
+                counts = phre.universe_counts(phas_path)
+                quiet, prev_counts = counts == prev_counts, counts
+            ahead.append(None if quiet else scrape_pool.submit(geha.scrape_snapshot, phas_path, None, bool(cube_every)))
+            if len(ahead) > 4 * scrapers:
+                parse = ahead.popleft()
+                yield parse.result() if parse is not None else None
+        while ahead:
+            parse = ahead.popleft()
+            yield parse.result() if parse is not None else None
 
+    # Performance metric.
+    print("Scraper started at " + datetime.now().strftime("%H:%M:%S"))
+    if adaptive and launcher == "bat":
+        raise ValueError("Adaptive steps are picked on the fly, so they need the argv launcher.")
+    if adaptive and disk_budget:
+        raise ValueError("Adaptive steps are all simulated before any is scraped, so disk_budget cannot bound them.")
+    # Copy EVOLVE and PHASCII from template.
+    if prep: prep_new_run()
+    journal_path = run_dirpath / ("journal_" + run_num + ".txt")
+    entries = []
+    # Steps simulated before a crash but never scraped: their snapshots are used as they are.
+    reuse = set()
+    if resume and journal_path.exists():
+        entries = load_journal(journal_path)
+        markers = [e["landed"] for e in entries if "landed" in e]
+        entries = [e for e in entries if "landed" not in e]
+        # Carry on from the last journaled step whose EVOLVE is still on disk, compressed or not.
+        goods = [e["step"] for e in entries
+                 if (run_dirpath / (run_name + "_" + str(e["step"]) + ".evolve")).exists()
+                 or (run_dirpath / (run_name + "_" + str(e["step"]) + ".evolve.xz")).exists()]
+        if goods and max(goods) > start_step:
+            last_good = max(goods)
+            evin_path = run_dirpath / (run_name + "_" + str(last_good) + ".evolve")
+            if not evin_path.exists():
+                baru.decompress_snapshot(evin_path.with_name(evin_path.name + ".xz"))
+            # Later entries get scraped again.
+            entries = [e for e in entries if e["step"] <= last_good]
+            time_period -= last_good - start_step
+            start_step = last_good
+            print("Resuming from step " + str(start_step) + " with " + str(time_period) + " steps left.")
+        # Step names only match the updates run when interval is 1, or in adaptive mode.
+        if adaptive or interval == 1:
+            reuse = {step for step in markers if start_step < step <= start_step + time_period
+                     and (run_dirpath / (run_name + "_" + str(step) + ".txt")).exists()
+                     and (run_dirpath / (run_name + "_" + str(step) + ".evolve")).exists()}
+        if reuse:
+            print("Reusing " + str(len(reuse)) + " steps simulated but not scraped before.")
+        replay_journal(entries)
+    # Organisms alive at the last scraped step, oldest first. A dict for its order, used as a set.
+    living = dict.fromkeys(book_of_life.living())
+    # The book and genome files grow during the run: genomes when first seen, book entries when their organism dies.
+    genome_writer = bkpr.RecordWriter(strain_genome_path)
+    book_writer = bkpr.RecordWriter(book_path)
+    for vital_stats, aaff_string in strain_genome.items():
+        genome_writer.write(vital_stats, aaff_string)
+    for vital_stats, life in book_of_life.items():
+        if len(life) > 1:
+            book_writer.write(vital_stats, life)
+    # Only the living need their genomes at hand, for delta scrapes.
+    for vital_stats in [vs for vs in strain_genome if vs not in living]:
+        del strain_genome[vital_stats]
+    # The kept entries go to a temporary file that replaces the journal only once it is on disk,
+    # so dying here still leaves a journal to resume from. The book and genome files are rebuilt from it.
+    journal_tmp = journal_path.with_name(journal_path.name + ".part")
+    with open(journal_tmp, "w", encoding="utf-8") as f:
+        f.writelines(dumps(e) + "\n" for e in entries)
+        f.writelines(dumps({"landed": step}) + "\n" for step in sorted(reuse))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(journal_tmp, journal_path)
+    journal = open(journal_path, "a", encoding="utf-8")
+    journal_lock = threading.Lock()
+    journal_count = 0
+    cube = []
+    # UNIVERSE counters of the last scraped step, for skip_quiet.
+    last_counts = None
+    # Bounded snapshot queue: launches pause while unscraped snapshots exceed disk_budget bytes.
+    snapshots = None
+    stale_evolve = None
+    if disk_budget:
+        snapshots = baru.SnapshotBudget(disk_budget)
+        pipeline = True
+        # Disk use only stays flat if each snapshot is deleted once scraped (keep_every ones are compressed).
+        delete = True
+    if launcher == "bat":
+        bfpaths, evoofnames = pregen_batches(start_step, time_period, interval)
+    elif launcher == "queue":
+        # Workers on any host that mounts run_dirpath pick the steps up, see work_queue.py.
+        argv_launcher = wq.QueueLauncher(run_dirpath / "queue")
+        bfpaths, evoofnames = [], step_names(start_step, time_period, interval)
+    else:
+        # Build each evolve_batch call in memory: no BAT files to write, run or delete.
+        argv_launcher = baru.ArgvLauncher(evolve_exe)
+        bfpaths, evoofnames = [], step_names(start_step, time_period, interval)
+    # Parse snapshots in separate processes; only merging into the book stays on this one.
+    scrape_pool = None
+    if scrapers and delta:
+        # The workers never see strain_genome, so they could not tell who is new.
+        print("Delta scraping needs the book, so scrapers are not used.")
+    elif scrapers and not speed:
+        # Spawn like on Windows: forking while the launch threads run can deadlock the children.
+        scrape_pool = ProcessPoolExecutor(scrapers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        if adaptive:
+            # Steps are named after the updates run since start_step; scrape with timestep = step-1 as usual.
+            run_steps, run_stats = adaptive_run()
+            phas_paths = [run_dirpath / (run_name + "_" + str(step) + ".txt") for step in run_steps]
+            for step, phas_path, parsed in zip(run_steps, phas_paths, scraped(phas_paths)):
+                scrape_step(step-1, phas_path, parsed)
+        elif pipeline:
+            # Scrape each PHASCII while later steps are still simulating.
+            run_stats = pipe_run()
+        else:
+            landed, run_stats = bunch_run()
+            # evin_fname = run_name + "_" + str(start_step)
+            timesteps, phas_paths = [], []
+            for timestep, evoofn in zip(range(start_step, start_step+time_period, interval), evoofnames):
+                if int(evoofn.split('_')[-1]) in landed:
+                    timesteps.append(timestep)
+                    phas_paths.append(run_dirpath / (evoofn + ".txt"))
+                else:
+                    print("No PHASCII for step " + evoofn.split('_')[-1] + ", skipping.")
+            for timestep, phas_path, parsed in zip(timesteps, phas_paths, scraped(phas_paths)):
+                scrape_step(timestep, phas_path, parsed)
+        if cube_every:
+            flush_cube()
+    finally:
+        # Also on an error, so the parse workers and the journal are not left open.
+        if scrape_pool is not None:
+            scrape_pool.shutdown(cancel_futures=True)
+        journal.close()
     # If not speed, outputs empty files.
+    # book_of_life file: Records parentage. Genealogy to phylogeny. The living go in last, with no death-step.
+    for vital_stats in living:
+        book_writer.write(vital_stats, book_of_life.life(vital_stats))
+    genome_writer.close()
+    book_writer.close()
+    # Both were written in the order things happened, so sort them by ID.
     # strain_genome file: Stores genomes only.
-    glue_book(strain_genome_path, strain_genome)
-    # book_of_life file: Records parentage. Genealogy to phylogeny.
-    glue_book(book_path, book_of_life)
+    bkpr.compact_by_id(strain_genome_path)
+    bkpr.compact_by_id(book_path)
+    # spore_ledger file: How long each spore waited, and the ones that never hatched.
+    glue_spores(spore_path)
     print("Scraper finished at " + datetime.now().strftime("%H:%M:%S"))
     pr.disable()
     pr.print_stats(sort='time')
+    return run_stats
 
     # Automate archiving? Store run archive in Evolve-Archives, retain starting files and ending files.
 
 
 # Convert string of numbers into organised df.
 def organise_book_of_life(book_path, save=True):
-    # Open the text archive.
-    with open(book_path, "rt") as f:
-        bol = f.readlines()
-    # bol = book_path.read_text(encoding="utf-8").splitlines()
     # Format of an organism's entry: "31 1 1 1:[211, 387]/n"
-    # Process the string into lists.
-    idnums = [int(x.split(" ")[0]) for x in bol]
-    sporelayers = [int(x.split(" ")[1]) for x in bol]
-    sporeqks = [int(x.split(" ")[2]) for x in bol]
-    generations = [int(x.split(" ")[3].split(":")[0]) for x in bol]
-    lifesteps = [x.split(":")[1][1:-2].split(",") for x in bol]
-    birthsteps = [int(x[0]) for x in lifesteps]
     # For still-living organisms, set death-step to 0 so that lifespan will become negative.
-    deathsteps = [int(x[1]) if len(x) > 1 else 0 for x in lifesteps]
-    # Combine all the lists into a df.
-    zipped = zip(idnums, sporelayers, sporeqks, generations, birthsteps, deathsteps)
-    bcols = ["ID", "Sporelayer", "Quickener", "Generation", "Birth_step", "Death_step"]
-    blife_df = pd.DataFrame(zipped, columns=bcols)
+    # Parsed in one pass, or read from the .npz sidecar if the book has not changed since.
+    blife_df = pd.DataFrame(bkpr.load_book(book_path, living_death=0))
     blife_df.set_index(["ID"], inplace=True)
     # Sort because organisms aren't added to the archive in order.
     blife_df = blife_df.sort_values(by=["ID"])
@@ -349,6 +693,13 @@ def organise_book_of_life(book_path, save=True):
     return blife_df
 
 
+# Spore ledger as a df. Spores still waiting at the last scraped step have Last_step equal to that step.
+def load_spore_ledger(spore_path):
+    spore_df = pd.read_csv(spore_path, dtype={"Genome_hash": str})
+    spore_df["Wait"] = spore_df.Last_step - spore_df.First_step
+    return spore_df
+
+
 def examine_book_of_life(blife_df):
     # ===== Data Handling =====
     # Check which organism lived the longest.
@@ -376,6 +727,39 @@ def examine_book_of_life(blife_df):
     print(blife_df.loc[blife_df.Sex_check != 0, "Quickener"].value_counts().head())
 
 
+# Sanity check 1: Population census.
+# Every organism in a reference snapshot should be alive in the book at that timestep.
+# Only the ORGANISM header lines are decoded, never the programs or CELL states.
+def snapshot_check(xpmt_df, check_p, toggle=True):
+    tail = xpmt_df.tail(1).index[0]
+    ceil = max(tail, len(xpmt_df))
+    schk = set(range(1, ceil+1)) - set(xpmt_df.index)
+    print("Missing: " + str(len(schk)))
+    # Export PHASCIIs for the reference universes, e.g. copied from the 'parallel' runs.
+    if toggle:
+        argv_launcher = baru.ArgvLauncher(evolve_exe)
+        for chp in check_p.glob("*.evolve"):
+            argv_launcher.export(chp).wait()
+    chk_orgids = []
+    for pf in list(check_p.glob("*.txt")) + list(check_p.glob("*.evsnap")):
+        if pf.suffix == ".evsnap":
+            with bisn.BinarySnapshot(pf) as snap:
+                orgids = snap.organisms[:, 0].tolist()
+        else:
+            orgids = [org.id for org in geha.get_organics_from_universe(pf, ["ORGANISM"], structured=True)["ORGANISM"]]
+        tstep = int(pf.stem.split('_')[-1])
+        # Filter out orgids that are missing from xpmt_df.
+        cx = [org for org in orgids if org not in schk]
+        # Find all orgids within experiment_df and check that they were indeed alive during that timestep.
+        mini_df = xpmt_df.loc[cx]
+        chk_orgids.append({'timestep': tstep,
+                           'younglings': list(mini_df[mini_df.Birth_step > tstep].index),
+                           'ghosts': list(mini_df[mini_df.Death_step < tstep].index)})
+    co_df = pd.DataFrame(chk_orgids)
+    co_df.sort_values('timestep', inplace=True)
+    return co_df
+
+
 # Track contents of archive.
 def record_archives():
     rxiv_path = Path.cwd().parent / 'Evolve-Archives'
@@ -396,8 +780,7 @@ def collate_books(run_nums_list,grp_num="002"):
     # Assume list of ints.
     run_nums_list.sort()
     r_nstr_list = [f"{x:03}" for x in run_nums_list]
-    coll_b = pd.DataFrame()
-    # dfdict = {}
+    bdfs = []
     # Merge with the later run as priority.
     for r in reversed(r_nstr_list):
         print("Progress update at " + datetime.now().strftime("%H:%M:%S"))
@@ -405,15 +788,10 @@ def collate_books(run_nums_list,grp_num="002"):
         bkpath = rdpath / ("book_of_life_" + r + ".txt")
         sgpath = rdpath / ("strain_genome_" + r + ".txt")
         sdf = organise_book_of_life(bkpath, save=False)
-        bdf = geha.stitch_sgen(sdf, sgpath)
-        # dfdict[r] = bdf[:]
-        if not coll_b.empty:
-            # coll_b = pd.concat([coll_b, bdf]).drop_duplicates()
-            coll_b = pd.concat([coll_b, bdf])
-            coll_b = coll_b[~coll_b.index.duplicated(keep='first')]
-        else:
-            coll_b = bdf.loc[:]
-    # return coll_b, dfdict
+        bdfs.append(geha.stitch_sgen(sdf, sgpath))
+    # One concat at the end instead of one per run; the first (latest) copy of each ID is kept.
+    coll_b = pd.concat(bdfs)
+    coll_b = coll_b[~coll_b.index.duplicated(keep='first')]
     return coll_b.sort_index()
 
 
@@ -445,7 +823,9 @@ def driver(base, target, gap=-1, match=1, mismatch=-1, debug=False):
     GlobalAlignment.driver(gb, gt, gap, match, mismatch, debug)
 
 # ===== EXECUTION =====
-record_archives()
+# Only when run as a script, so the orchestrator's worker processes can import this module quietly.
+if __name__ == "__main__":
+    record_archives()
 # Create a version without the genome col.
 # sbol_df = organise_book_of_life(book_path)
 # bgen_df = geha.stitch_sgen(sbol_df, strain_genome_path)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Filename: evolve_standin.py
+Date created: 2026/10/18, Sun, 11:05:00 (UTC+8)
+@author: LioHong
+Purpose: Stand-in for evolve_batch that replays recorded EVOLVE/PHASCII pairs, so runs can be benchmarked on Linux.
+Steps:
+1. Read the step of the input universe and add the requested number of updates.
+2. Find the recorded snapshot for that step in the corpus, e.g. Runs/Grp_002/Run_074.
+3. Sleep for the configured latency to emulate the real cost of the step.
+4. Copy the recording to the output path, as EVOLVE or PHASCII depending on its extension.
+
+Usage: python evolve_standin.py [--corpus DIR] [--latency S] [--per-update S] [--exact] s Nu in out
+The options can also come from EVOLVE_STANDIN_CORPUS, EVOLVE_STANDIN_LATENCY and EVOLVE_STANDIN_PER_UPDATE.
+"""
+import os
+import sys
+import struct
+import argparse
+from bisect import bisect_right
+from pathlib import Path
+from shutil import copyfile
+from time import sleep
+
+default_corpus = Path(__file__).parent / "Runs" / "Grp_002" / "Run_074"
+# EVOLVE binary header: 30-byte magic, then SEED (int32) and STEP (int64).
+evolve_magic = b"EVOLVE_BINARY_FORMAT:"
+evolve_step = struct.Struct("<iq")
+
+
+# Step of a universe file, from the EVOLVE header, the PHASCII UNIVERSE line or else the filename.
+def read_step(univ_path):
+    univ_path = Path(univ_path)
+    with open(univ_path, "rb") as f:
+        head = f.read(4096)
+    if head.startswith(evolve_magic):
+        return evolve_step.unpack_from(head, 30)[1]
+    for line in head.splitlines():
+        if line.startswith(b"UNIVERSE "):
+            return int(line.split()[2])
+    return int(univ_path.stem.split('_')[-1])
+
+
+# {step: {".evolve": path, ".txt": path}} for every "<run_name>_<step>" file in the corpus.
+def index_corpus(corpus_path):
+    recordings = {}
+    for rfile in Path(corpus_path).iterdir():
+        if rfile.suffix not in (".evolve", ".txt"):
+            continue
+        stnm = rfile.stem.split('_')[-1]
+        if stnm.isdigit():
+            recordings.setdefault(int(stnm), {})[rfile.suffix] = rfile
+    return recordings
+
+
+# Exact match, or else the latest recording at or before the target step.
+def pick_recording(recordings, target, suffix, exact=False):
+    if exact:
+        return recordings.get(target, {}).get(suffix)
+    steps = sorted(s for s in recordings if suffix in recordings[s])
+    i = bisect_right(steps, target)
+    return recordings[steps[i-1]][suffix] if i else None
+
+
+# Argv prefix to plug into ArgvLauncher / evolve_executor.evolve_exe.
+def standin_argv(corpus_path=default_corpus, latency=0.0, per_update=0.0, exact=False):
+    argv = [sys.executable, str(Path(__file__).resolve()), "--corpus", str(Path(corpus_path).resolve()),
+            "--latency", str(latency), "--per-update", str(per_update)]
+    return argv + ["--exact"] if exact else argv
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded snapshots in place of evolve_batch.")
+    parser.add_argument("--corpus", default=os.environ.get("EVOLVE_STANDIN_CORPUS", default_corpus))
+    parser.add_argument("--latency", type=float, default=float(os.environ.get("EVOLVE_STANDIN_LATENCY", 0)))
+    parser.add_argument("--per-update", type=float, default=float(os.environ.get("EVOLVE_STANDIN_PER_UPDATE", 0)))
+    parser.add_argument("--exact", action="store_true")
+    parser.add_argument("mode", choices=["s"])
+    parser.add_argument("updates")
+    parser.add_argument("in_path")
+    parser.add_argument("out_path")
+    args = parser.parse_args(argv)
+
+    updates = int(args.updates.rstrip("u"))
+    target = read_step(args.in_path) + updates
+    out_path = Path(args.out_path)
+    suffix = ".txt" if out_path.suffix == ".txt" else ".evolve"
+    recording = pick_recording(index_corpus(args.corpus), target, suffix, args.exact)
+    if recording is None:
+        print("No recorded " + suffix + " for step " + str(target) + " in " + str(args.corpus), file=sys.stderr)
+        return 1
+    sleep(args.latency + args.per_update * updates)
+    # Write under a temporary name first so watchers never see half a file.
+    tmp_path = out_path.with_name(out_path.name + ".part")
+    copyfile(recording, tmp_path)
+    os.replace(tmp_path, out_path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
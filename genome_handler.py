@@ -6,11 +6,16 @@ Date created: 2024/03/05, Tue, 21:04:00 (UTC+8)
 Purpose: Packages all functions relating to KFORTH genome handling.
 Steps:
 """
+import re
 import numpy as np
 from os import system
 from json import dump, loads
+from hashlib import blake2b
 from pathlib import Path
+from datetime import datetime
 from pandas import read_csv
+import phascii_reader as phre
+import book_keeper as bkpr
 
 # https://stackoverflow.com/questions/28730961/python-slicing-string-in-three-character-substrings
 def pair_split(elm):
@@ -18,6 +23,15 @@ def pair_split(elm):
 
 instr_aaff_dict = eval(Path("instr_aaff_dict.txt").read_text(encoding="utf-8"))
 aaff_instr_dict = {v: k for k, v in instr_aaff_dict.items()}
+# The dict keys are the old scraper's renamed spellings. Tokens from phascii_reader are clean.
+# The old scraper only renamed "-" between two spaces, so a "-" at either end of a program row was stored
+# as a bare "-" (e.g. "AWEO-_-33_"). Every "-" is now "DJ", so strain_genome files from before differ there.
+instr_aaff_dict.update({"MAKE-SPORE": "BQ", "NUM-CELLS": "EW", "-": "DJ"})
+# A bare "-" in an old AAFF string, as opposed to the sign of a number.
+old_minus = re.compile(r"-(?![0-9])")
+# Record keyword -> the phre.Universe property that reads it.
+universe_sections = {"SPORE": "spores", "ORGANISM": "organisms", "CELL": "cells", "ORGANIC": "organics",
+                     "BARRIER": "barriers"}
 
 
 # Small but useful for quick manual exports: Copy list to clipboard for pasting elsewhere.
@@ -28,22 +42,36 @@ def addToClipBoard(read_list):
     system(command)
 
 
-# Setup the dicts as basis for comparison. Input is text content of file.
-def get_organics_from_universe(text_phascii, keys=["SPORE","ORGANISM"]):
-    # with open(file_phascii, "rt") as fph:
-    #     text_phascii = fph.readlines()
-    # org_dict = {"SPORE": [], "ORGANISM": []}
-    # org_dict = dict.fromkeys(keys)
-    org_dict = {}
-    for organic in keys:
-        org_dict[organic] = []
-        for line in text_phascii:
-            if organic in line:
-                if organic == "SPORE":
-                    org_dict[organic].append(line)
-                elif organic == "ORGANISM":
-                    # Must remove the Energy and Age which can change over time.
-                    org_dict[organic].append(line.split(' ')[:-2])
+# Setup the dicts as basis for comparison. Input is the path to the PHASCII or its lines.
+# All keys come out of one pass, matching only the record keyword at the start of a line.
+# structured=True gives Organism/Spore/Cell/Organic/Barrier records instead of SPORE lines and split ORGANISM lists.
+# From lines, programs are filled in too. From a path the file is closed on return, so use phre.Universe.
+# ORGANIC and BARRIER can only be read from a path.
+def get_organics_from_universe(text_phascii, keys=["SPORE","ORGANISM"], structured=False):
+    if isinstance(text_phascii, (str, Path)):
+        # From a path, only the header lines of the keys asked for are decoded.
+        with phre.Universe(text_phascii) as univ:
+            org_dict = {organic: getattr(univ, universe_sections[organic]) for organic in keys}
+    else:
+        if set(keys) - set(phre.record_classes):
+            raise ValueError("Only SPORE, ORGANISM and CELL can be read from lines, not " +
+                             ", ".join(sorted(set(keys) - set(phre.record_classes))))
+        org_dict = phre.extract_records(text_phascii, keys, programs=structured)
+    if structured:
+        return org_dict
+    if "SPORE" in org_dict:
+        org_dict["SPORE"] = [" ".join(str(x) for x in ["SPORE", sp.x, sp.y, sp.energy, sp.parent, sp.strain,
+                                                       sp.sflags]) for sp in org_dict["SPORE"]]
+    if "ORGANISM" in org_dict:
+        # Must remove the Energy and Age which can change over time.
+        org_dict["ORGANISM"] = [[str(x) for x in ["ORGANISM", org.id, org.strain, org.oflags, org.parent1,
+                                                  org.parent2, org.generation]] for org in org_dict["ORGANISM"]]
+    if "CELL" in org_dict:
+        org_dict["CELL"] = [" ".join(str(x) for x in ["CELL", c.organism_id, c.x, c.y]) for c in org_dict["CELL"]]
+    if "ORGANIC" in org_dict:
+        org_dict["ORGANIC"] = [" ".join(str(x) for x in ["ORGANIC", o.x, o.y, o.energy]) for o in org_dict["ORGANIC"]]
+    if "BARRIER" in org_dict:
+        org_dict["BARRIER"] = [" ".join(str(x) for x in ["BARRIER", b.x, b.y]) for b in org_dict["BARRIER"]]
     return org_dict
 
 
@@ -88,6 +116,50 @@ def shrink_kforth_to_aaff(kforth_genome):
     return aaff_genome
 
 
+# KFORTH tokens straight to the stored AAFF string.
+def encode_kforth(kforth_genome):
+    return store_aaff(shrink_kforth_to_aaff(kforth_genome))
+
+
+# Short stable fingerprint of a genome, the same in every process and every run.
+def hash_aaff(aaff_string):
+    return blake2b(aaff_string.encode("utf-8"), digest_size=8).hexdigest()
+
+
+# Everything the scraper needs from one PHASCII, in file order:
+# organisms as (vital_stats, aaff_string) and spores as (x, y, energy, parent, strain, sflags, genome_hash),
+# plus the occupancy grids if asked for. Top-level so the scraper can run it in a process pool.
+# Programs never change after birth: organisms in `known` get None and their program is never decoded.
+def scrape_snapshot(phas_path, known=None, grids=False):
+    organisms = []
+    with phre.Universe(phas_path) as univ:
+        for org in univ.organisms:
+            vital_stats = org.vital_stats
+            if known is not None and vital_stats in known:
+                organisms.append((vital_stats, None))
+            else:
+                organisms.append((vital_stats, encode_kforth(org.program)))
+        spores = univ_spores(univ)
+        occupancy = univ.occupancy() if grids else None
+    return organisms, spores, occupancy
+
+
+def univ_spores(univ):
+    return [(sp.x, sp.y, sp.energy, sp.parent, sp.strain, sp.sflags, hash_aaff(encode_kforth(sp.program)))
+            for sp in univ.spores]
+
+
+# Just the spores of a PHASCII, as in scrape_snapshot(). ORGANISM and CELL records are never decoded.
+def scrape_spores(phas_path):
+    with phre.Universe(phas_path) as univ:
+        return univ_spores(univ)
+
+
+# AAFF string from before "-" had its own code, in today's spelling.
+def respell_aaff(aaff_string):
+    return old_minus.sub("DJ", aaff_string)
+
+
 # To eyeball the genome.
 def translate_aaff_to_kforth(aaff_string):
     aaff_genome = retrieve_aaff(aaff_string)
@@ -112,7 +184,8 @@ def load_strain_genome(path_sgen):
     with open(path_sgen, "rt") as f:
         sfgen = f.readlines()
     keys = [int(x.split(" ")[0]) for x in sfgen]
-    values = [x.split(":")[1][:-2] for x in sfgen]
+    # Old files may have "-" where new ones have "DJ": respell so cache_genomes() sees one genome, not two.
+    values = [respell_aaff(x.split(":")[1][:-2]) for x in sfgen]
     sfgen_dict = dict(zip(keys, values))
     return sfgen_dict
 
@@ -175,42 +248,23 @@ def compress_book(bgen_df, path_bgen, path_sgen, path_cgen, path_cgd, threshold=
 
 
 # Another problem: How to stitch book_of_life and strain_genome from consecutive runs?
+# One k-way merge by ID per file type, the later run winning. The combos go in the last run's folder.
 def collate_books(run_nums_list,grp_num="002"):
     # Assume list of ints.
     run_nums_list.sort()
     r_nstr_list = [f"{x:03}" for x in run_nums_list]
     last = f"{run_nums_list[-1]:03}"
+    grp_path = Path(".") / "Runs" / ("Grp_" + grp_num)
     # Merge with the later run as priority.
-    coll_b = []
-    coll_s = []
-    for r in reversed(r_nstr_list):
-        print("Progress update at " + datetime.now().strftime("%H:%M:%S"))
-        rdpath = Path(".") / "Runs" / ("Grp_" + grp_num) / ("Run_" + r)
-        bkpath = rdpath / ("book_of_life_" + r + ".txt")
-        sgpath = rdpath / ("strain_genome_" + r + ".txt")
-        bk = bkpath.read_text(encoding="utf-8").splitlines()
-        sg = sgpath.read_text(encoding="utf-8").splitlines()
-        # Refer from book_of_life because smaller filesize is easier to manage.
-        orgids = [b.split(' ')[0] for b in bk]
-        if (coll_b):
-            og = [b.split(' ')[0] for b in coll_b]
-            # Add orgids only if not in later run.
-            # add_b = [bk[orgids.index(bb)] for bb in orgids if bb not in og]
-            # lost_ones = [orgids.index(bb) for bb in orgids if bb not in og]
-            lost_ones = [bb for bb in orgids if bb not in og]
-            lost_ones = [orgids.index(lo) for lo in lost_ones]
-            add_b = [bk[i] for i in lost_ones]
-            add_s = [sg[i] for i in lost_ones]
-            # Combine lists.
-            coll_b = coll_b + add_b
-            coll_s = coll_s + add_s
-            coll_b.sort()
-            coll_s.sort()
-        else:
-            coll_b = bk[:]
-            coll_s = sg[:]
-        (rdpath / ("book_of_life_" + last + "_combo.txt")).write_text("\n".join(coll_b), encoding="utf-8")
-        (rdpath / ("strain_genome_" + last + "_combo.txt")).write_text("\n".join(coll_s), encoding="utf-8")
+    rdpaths = [(grp_path / ("Run_" + r), r) for r in reversed(r_nstr_list)]
+    print("Progress update at " + datetime.now().strftime("%H:%M:%S"))
+    bkpaths = [rdpath / ("book_of_life_" + r + ".txt") for rdpath, r in rdpaths]
+    sgpaths = [rdpath / ("strain_genome_" + r + ".txt") for rdpath, r in rdpaths]
+    last_path = grp_path / ("Run_" + last)
+    nb = bkpr.merge_by_id(bkpaths, last_path / ("book_of_life_" + last + "_combo.txt"))
+    ns = bkpr.merge_by_id(sgpaths, last_path / ("strain_genome_" + last + "_combo.txt"))
+    print("Collated " + str(nb) + " organisms and " + str(ns) + " genomes at " + datetime.now().strftime("%H:%M:%S"))
+    return nb, ns
 
 
 # Measure genome length
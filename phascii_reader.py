@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+Filename: phascii_reader.py
+Date created: 2026/10/18, Sun, 11:40:00 (UTC+8)
+@author: LioHong
+Purpose: Read PHASCII (PHOTON ASCII) universe snapshots without going through the whole file.
+Steps:
+1. Read only as far as the UNIVERSE line to get the header counters.
+2. Memory-map the file, index where each top-level record starts, and decode only the records asked for.
+3. Universe wraps the index with typed records, each section parsed the first time it is used.
+4. Turn CELL, ORGANIC and BARRIER records into WIDTH x HEIGHT grids, and stack those into a compressed time cube.
+
+"""
+import re
+import mmap
+from array import array
+from pathlib import Path
+import numpy as np
+
+# Order of the fields on the "UNIVERSE seed step next_id nborn ndie width height" line.
+universe_fields = ["SEED", "STEP", "NEXT_ID", "NBORN", "NDIE", "WIDTH", "HEIGHT"]
+# Top-level records are the only lines starting with a capital letter: UNIVERSE, ER, KFMO, BARRIER,
+# KEYLIST, ORGANIC, SPORE, ORGANISM, CELL. Struct definitions start with "struct", everything else is indented.
+record_start = re.compile(rb"^[A-Z]+", re.M)
+
+
+# The UNIVERSE line sits right after the struct definitions, so only the start of the file is read.
+def read_universe_header(phas_path, chunk=4096):
+    buf = b""
+    with open(phas_path, "rb") as f:
+        while True:
+            more = f.read(chunk)
+            buf += more
+            i = buf.find(b"\nUNIVERSE ")
+            if i >= 0:
+                j = buf.find(b"\n", i + 1)
+                if j >= 0 or not more:
+                    line = buf[i + 1:j if j >= 0 else len(buf)]
+                    return dict(zip(universe_fields, [int(x) for x in line.split()[1:8]]))
+            if not more:
+                raise ValueError("No UNIVERSE line in " + str(phas_path))
+
+
+# Cumulative counters: if all three match between two snapshots, nobody was born or died in between.
+def universe_counts(phas_path):
+    head = read_universe_header(phas_path)
+    return head["NEXT_ID"], head["NBORN"], head["NDIE"]
+
+
+# KFORTH words of a program's quoted lines, labels without their colon and no braces.
+def program_tokens(program):
+    return [t.rstrip(":") for t in " ".join(program).replace('"', " ").split() if t != "{" and t != "}"]
+
+
+# Offsets of every top-level record in a memory-mapped PHASCII. Nothing is decoded until asked for,
+# so e.g. reading the ORGANISM headers never touches the CELL machine states.
+class PhasciiIndex(object):
+    def __init__(self, phas_path):
+        self.phas_path = Path(phas_path)
+        with open(self.phas_path, "rb") as f:
+            # An empty file cannot be mapped, but it has no records either.
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.phas_path.stat().st_size else b""
+        # Start of each record, in file order, and the offsets of each kind of record.
+        self.starts = array("q")
+        self.kinds = {}
+        for m in record_start.finditer(self.mm):
+            self.kinds.setdefault(m.group().decode("ascii"), array("q")).append(len(self.starts))
+            self.starts.append(m.start())
+        self.starts.append(len(self.mm))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Close before deleting the file: Windows refuses to delete a mapped file.
+    def close(self):
+        if isinstance(self.mm, mmap.mmap):
+            self.mm.close()
+
+    def count(self, kind):
+        return len(self.kinds.get(kind, ()))
+
+    # Raw bytes of each record of a kind, from its keyword up to the next record.
+    def iter_bytes(self, kind):
+        for i in self.kinds.get(kind, ()):
+            yield self.mm[self.starts[i]:self.starts[i+1]]
+
+    def iter_text(self, kind):
+        for rec in self.iter_bytes(kind):
+            yield rec.decode("utf-8")
+
+    # Words of just the first line of each record, e.g. ORGANISM: id strain oflags p1 p2 gen energy age.
+    def iter_fields(self, kind):
+        for i in self.kinds.get(kind, ()):
+            start = self.starts[i]
+            end = self.mm.find(b"\n", start, self.starts[i+1])
+            yield self.mm[start:end if end >= 0 else self.starts[i+1]].decode("utf-8").split()[1:]
+
+    def header(self):
+        fields = next(self.iter_fields("UNIVERSE"))
+        return dict(zip(universe_fields, [int(x) for x in fields]))
+
+    # Tokens of the program in the n-th record of a kind.
+    def program(self, kind, n):
+        i = self.kinds[kind][n]
+        rec = self.mm[self.starts[i]:self.starts[i+1]].decode("utf-8")
+        return program_tokens([line for line in rec.splitlines() if line.startswith('\t"')])
+
+
+# Compact records for the universe model. Programs stay in the file until .program is read.
+class Organism(object):
+    __slots__ = ["id", "strain", "oflags", "parent1", "parent2", "generation", "energy", "age", "_univ", "_n", "_program"]
+
+    def __init__(self, fields, univ=None, n=None):
+        (self.id, self.strain, self.oflags, self.parent1, self.parent2,
+         self.generation, self.energy, self.age) = [int(x) for x in fields[:8]]
+        self._univ, self._n, self._program = univ, n, None
+
+    # Key of the organism in the book of life: "id p1 p2 gen". ENERGY and AGE change over time.
+    @property
+    def vital_stats(self):
+        return str(self.id) + " " + str(self.parent1) + " " + str(self.parent2) + " " + str(self.generation)
+
+    @property
+    def program(self):
+        if self._program is None:
+            self._program = self._univ.index.program("ORGANISM", self._n)
+        return self._program
+
+
+class Spore(object):
+    __slots__ = ["x", "y", "energy", "parent", "strain", "sflags", "_univ", "_n", "_program"]
+
+    def __init__(self, fields, univ=None, n=None):
+        self.x, self.y, self.energy, self.parent, self.strain, self.sflags = [int(x) for x in fields[:6]]
+        self._univ, self._n, self._program = univ, n, None
+
+    @property
+    def program(self):
+        if self._program is None:
+            self._program = self._univ.index.program("SPORE", self._n)
+        return self._program
+
+
+# Only the position of each cell; the machine state is left unparsed.
+class Cell(object):
+    __slots__ = ["organism_id", "x", "y"]
+
+    def __init__(self, fields):
+        self.organism_id, self.x, self.y = [int(x) for x in fields[:3]]
+
+
+class Organic(object):
+    __slots__ = ["x", "y", "energy"]
+
+    def __init__(self, x, y, energy):
+        self.x, self.y, self.energy = x, y, energy
+
+
+class Barrier(object):
+    __slots__ = ["x", "y"]
+
+    def __init__(self, x, y):
+        self.x, self.y = x, y
+
+
+record_classes = {"ORGANISM": Organism, "SPORE": Spore, "CELL": Cell}
+
+
+# Records from PHASCII lines already in memory, for every wanted kind in one pass.
+# Only lines whose first word is the keyword count, so struct fields like ORGANISM_ID and programs
+# containing MAKE-SPORE are never mistaken for records. Returns {kind: [Organism/Spore/Cell, ...]};
+# with programs=True the ORGANISM and SPORE records also get their programs.
+def extract_records(lines, kinds=("SPORE", "ORGANISM"), programs=False):
+    found = {kind: [] for kind in kinds}
+    wanted = [kind for kind in kinds if kind in record_classes]
+    if not lines or not wanted:
+        return found
+    # A leading newline lets every record be found as "\nKIND ", which re scans much faster than ^ with re.M.
+    text = "\n" + ("".join(lines) if lines[0].endswith("\n") else "\n".join(lines))
+    for m in re.finditer("\n(" + "|".join(wanted) + ") ([^\n]*)", text):
+        kind = m.group(1)
+        rec = record_classes[kind](m.group(2).split())
+        if programs and kind != "CELL":
+            end = text.find("\n  }", m.end())
+            rec._program = program_tokens([line for line in text[m.end():end].split("\n") if line.startswith('\t"')])
+        found[kind].append(rec)
+    return found
+
+
+# One PHASCII snapshot. Each section is parsed the first time it is read, then kept.
+# Keep the Universe open while reading programs: they are decoded straight from the mapped file.
+class Universe(object):
+    __slots__ = ["index", "_header", "_organisms", "_spores", "_cells", "_organics", "_barriers"]
+
+    def __init__(self, phas_path):
+        self.index = PhasciiIndex(phas_path)
+        self._header = self._organisms = self._spores = self._cells = self._organics = self._barriers = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.index.close()
+
+    @property
+    def header(self):
+        if self._header is None:
+            self._header = self.index.header()
+        return self._header
+
+    @property
+    def step(self):
+        return self.header["STEP"]
+
+    @property
+    def organisms(self):
+        if self._organisms is None:
+            self._organisms = [Organism(f, self, n) for n, f in enumerate(self.index.iter_fields("ORGANISM"))]
+        return self._organisms
+
+    @property
+    def spores(self):
+        if self._spores is None:
+            self._spores = [Spore(f, self, n) for n, f in enumerate(self.index.iter_fields("SPORE"))]
+        return self._spores
+
+    @property
+    def cells(self):
+        if self._cells is None:
+            self._cells = [Cell(f) for f in self.index.iter_fields("CELL")]
+        return self._cells
+
+    # ORGANIC { <tab>x<tab>y<tab>energy ... }
+    @property
+    def organics(self):
+        if self._organics is None:
+            self._organics = [Organic(*row) for row in self.rows("ORGANIC", 3)]
+        return self._organics
+
+    # BARRIER { <tab>x<tab>y ... }
+    @property
+    def barriers(self):
+        if self._barriers is None:
+            self._barriers = [Barrier(*row) for row in self.rows("BARRIER", 2)]
+        return self._barriers
+
+    # Grids indexed [y, x]: organism ID per square (0 if empty, IDs start at 1), food energy, barrier mask.
+    def occupancy(self):
+        height, width = self.header["HEIGHT"], self.header["WIDTH"]
+        orgid = np.zeros((height, width), dtype=np.int32)
+        food = np.zeros((height, width), dtype=np.int32)
+        barrier = np.zeros((height, width), dtype=bool)
+        if self.cells:
+            xyi = np.array([(c.x, c.y, c.organism_id) for c in self.cells], dtype=np.int32)
+            orgid[xyi[:, 1], xyi[:, 0]] = xyi[:, 2]
+        if self.organics:
+            xye = np.array([(o.x, o.y, o.energy) for o in self.organics], dtype=np.int32)
+            food[xye[:, 1], xye[:, 0]] = xye[:, 2]
+        if self.barriers:
+            xy = np.array([(b.x, b.y) for b in self.barriers], dtype=np.int32)
+            barrier[xy[:, 1], xy[:, 0]] = True
+        return {"orgid": orgid, "food": food, "barrier": barrier}
+
+    # Integer rows of a braced top-level section.
+    def rows(self, kind, width):
+        rows = []
+        for rec in self.index.iter_bytes(kind):
+            for line in rec.splitlines()[1:]:
+                words = line.split()
+                if len(words) == width:
+                    rows.append([int(x) for x in words])
+        return rows
+
+
+def occupancy_grids(phas_path):
+    with Universe(phas_path) as univ:
+        return univ.occupancy()
+
+
+# Stack per-step grids into one compressed .npz: steps (T,), orgid and food (T, H, W), barrier (T, H, W).
+def save_cube(cube_path, steps, grids):
+    np.savez_compressed(cube_path, steps=np.array(steps, dtype=np.int64),
+                        **{k: np.stack([g[k] for g in grids]) for k in ("orgid", "food", "barrier")})
+    return cube_path
+
+
+def load_cube(cube_path):
+    with np.load(cube_path) as cube:
+        return {k: cube[k] for k in cube.files}
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Filename: run_orchestrator.py
+Date created: 2026/10/18, Sun, 12:20:00 (UTC+8)
+@author: LioHong
+Purpose: Drive many Runs/Grp_*/Run_* experiments at once, sharing one CPU budget between them.
+Steps:
+1. Read the run specs: one row per run with grp_num, run_num, run_name, time_period and options.
+2. Start each run in its own process, which points evolve_executor at that run with set_run().
+3. All runs draw evolve_batch slots from one shared semaphore sized to the CPU budget.
+4. Keep a per-run status table on disk while the runs progress.
+
+Usage: python run_orchestrator.py run_specs.csv [--cpus 32] [--status run_status.csv]
+"""
+import os
+import sys
+import queue
+import argparse
+import multiprocessing
+from pathlib import Path
+from datetime import datetime
+import pandas as pd
+
+# Columns of a run spec. Everything after time_period is optional and passed to simulate_universe().
+spec_cols = ["grp_num", "run_num", "run_name", "time_period", "start_step", "interval", "delete",
+             "pipeline", "adaptive", "resume", "slots", "launcher", "scrapers", "disk_budget", "keep_every",
+             "delta", "skip_quiet", "cube_every", "keep_binary"]
+status_cols = ["grp_num", "run_num", "run_name", "state", "started", "finished", "steps", "steps_per_hour", "note"]
+
+
+# CSV with at least grp_num, run_num, run_name and time_period. Numbers keep their leading zeroes.
+def load_run_specs(spec_path):
+    spec_df = pd.read_csv(spec_path, dtype={"grp_num": str, "run_num": str, "run_name": str})
+    specs = []
+    for row in spec_df.to_dict(orient="records"):
+        specs.append({k: v for k, v in row.items() if k in spec_cols and not pd.isna(v)})
+    return specs
+
+
+# Runs inside a worker process.
+def drive_run(spec, budget, status_q, cpus, evolve_exe=None):
+    import evolve_executor as evex
+    key = (spec["grp_num"], spec["run_num"])
+    status_q.put((key, {"state": "running", "started": datetime.now().strftime("%H:%M:%S")}))
+    try:
+        evex.set_run(spec["grp_num"], spec["run_num"], spec["run_name"])
+        if evolve_exe is not None:
+            evex.evolve_exe = evolve_exe
+        kwargs = {k: v for k, v in spec.items() if k not in ("grp_num", "run_num", "run_name", "time_period")}
+        # A run may use the whole budget when the others are idle.
+        kwargs.setdefault("slots", cpus)
+        # pandas reads a column with blanks as float, e.g. keep_every 100.0.
+        for k in ("start_step", "interval", "slots", "scrapers", "disk_budget", "keep_every", "cube_every"):
+            if k in kwargs:
+                kwargs[k] = int(kwargs[k])
+        for k in ("delete", "pipeline", "adaptive", "resume", "delta", "skip_quiet", "keep_binary"):
+            if k in kwargs:
+                kwargs[k] = bool(kwargs[k])
+        run_stats = evex.simulate_universe(int(spec["time_period"]), budget=budget, **kwargs) or {}
+        status_q.put((key, {"state": "done", "steps": run_stats.get("steps"),
+                            "steps_per_hour": run_stats.get("steps_per_hour"),
+                            "note": "failed steps: " + str(run_stats.get("failed", 0))}))
+    except Exception as e:
+        status_q.put((key, {"state": "failed", "note": repr(e)}))
+    finally:
+        status_q.put((key, {"finished": datetime.now().strftime("%H:%M:%S")}))
+
+
+def write_status(status, status_path):
+    status_df = pd.DataFrame(list(status.values()), columns=status_cols)
+    status_df.to_csv(status_path, index=False)
+    return status_df
+
+
+# Start every run at once; the shared semaphore decides how many evolve_batch calls run at a time.
+# evolve_exe overrides evolve_executor.evolve_exe in every run, e.g. with evolve_standin.standin_argv().
+def orchestrate(specs, cpus=None, status_path=None, evolve_exe=None):
+    cpus = cpus or os.cpu_count() or 1
+    if status_path is None:
+        status_path = Path(".") / "Runs" / "run_status.csv"
+    # Spawn like on Windows, so each run gets a fresh copy of evolve_executor's globals.
+    ctx = multiprocessing.get_context("spawn")
+    budget = ctx.Semaphore(cpus)
+    status_q = ctx.Queue()
+    status = {}
+    procs = []
+    for spec in specs:
+        key = (spec["grp_num"], spec["run_num"])
+        status[key] = {"grp_num": spec["grp_num"], "run_num": spec["run_num"], "run_name": spec["run_name"],
+                       "state": "queued"}
+        procs.append(ctx.Process(target=drive_run, args=(spec, budget, status_q, cpus, evolve_exe)))
+    write_status(status, status_path)
+    print("Orchestrator started " + str(len(procs)) + " runs on " + str(cpus) + " cores at " +
+          datetime.now().strftime("%H:%M:%S"))
+    for proc in procs:
+        proc.start()
+    # Every run reports its finish time last.
+    finished = set()
+    while len(finished) < len(procs):
+        try:
+            key, update = status_q.get(timeout=1.0)
+        except queue.Empty:
+            # A run that died without reporting, e.g. killed from outside.
+            for spec, proc in zip(specs, procs):
+                key = (spec["grp_num"], spec["run_num"])
+                if key not in finished and proc.exitcode is not None and status_q.empty():
+                    status[key].update({"state": "failed", "note": "exit code " + str(proc.exitcode),
+                                        "finished": datetime.now().strftime("%H:%M:%S")})
+                    finished.add(key)
+                    write_status(status, status_path)
+            continue
+        status[key].update(update)
+        if "finished" in update:
+            finished.add(key)
+            if status[key]["state"] == "running":
+                status[key]["state"] = "failed"
+        write_status(status, status_path)
+    for proc in procs:
+        proc.join()
+    print("Orchestrator finished at " + datetime.now().strftime("%H:%M:%S"))
+    return write_status(status, status_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run many Evolve experiments concurrently.")
+    parser.add_argument("spec_path")
+    parser.add_argument("--cpus", type=int, default=None)
+    parser.add_argument("--status", default=None)
+    args = parser.parse_args()
+    print(orchestrate(load_run_specs(args.spec_path), args.cpus, args.status))
+    sys.exit(0)
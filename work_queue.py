@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Filename: work_queue.py
+Date created: 2026/10/18, Sun, 14:40:00 (UTC+8)
+@author: LioHong
+Purpose: Lease-based queue of evolve_batch steps kept in a shared run directory, so workers on several hosts can step one run.
+Steps:
+1. The coordinator (simulate_universe with launcher="queue") writes one job file per step into <queue>/todo.
+2. A worker claims a job by renaming it into <queue>/leased, which only one worker can win.
+3. The worker runs the step with its own evolve_batch and keeps touching the lease while it runs.
+4. Finished jobs move to <queue>/done or <queue>/failed; the coordinator sees that as the step finishing.
+5. Leases not touched for stale_secs are moved back to todo for another worker to pick up.
+
+Usage: python work_queue.py QUEUE_DIR [QUEUE_DIR ...] [--evolve-exe "PATH [ARGS]"] [--idle-exit S]
+Paths in the job files are relative to the run directory, so each host may mount it somewhere else.
+Rename is atomic on local disks, SMB and NFS. Lease ages use the file server's mtimes, so keep the clocks roughly in sync.
+"""
+import os
+import sys
+import json
+import shlex
+import socket
+import argparse
+import threading
+from pathlib import Path
+from time import sleep, monotonic, time
+from datetime import datetime
+import batch_runner as baru
+
+queue_subdirs = ["todo", "leased", "done", "failed"]
+# Separates the job name from the worker holding its lease, e.g. leased/smol02_17.job~host-1234.
+lease_sep = "~"
+
+
+def make_queue(queue_dir):
+    queue_dir = Path(queue_dir)
+    for sub in queue_subdirs:
+        (queue_dir / sub).mkdir(parents=True, exist_ok=True)
+    return queue_dir
+
+
+def worker_id():
+    return socket.gethostname() + "-" + str(os.getpid())
+
+
+# Write under a temporary name first so workers never claim half a job file.
+def write_job(queue_dir, job_name, job):
+    tmp_path = queue_dir / (job_name + ".part")
+    tmp_path.write_text(json.dumps(job), encoding="utf-8")
+    os.replace(tmp_path, queue_dir / "todo" / job_name)
+
+
+# Rename stalled leases back into todo. Returns the names of the jobs that were put back.
+def reap_leases(queue_dir, stale_secs):
+    reaped = []
+    now = time()
+    for lease_path in (Path(queue_dir) / "leased").iterdir():
+        try:
+            if now - lease_path.stat().st_mtime <= stale_secs:
+                continue
+            job_name = lease_path.name.split(lease_sep)[0]
+            os.rename(lease_path, Path(queue_dir) / "todo" / job_name)
+        except FileNotFoundError:
+            # Finished or reaped by someone else in the meantime.
+            continue
+        print("Lease on " + job_name + " went stale, requeued at " + datetime.now().strftime("%H:%M:%S"))
+        reaped.append(job_name)
+    return reaped
+
+
+# Popen-like handle for a queued step: wait() returns once some worker has finished it.
+class QueuedJob(object):
+    def __init__(self, launcher, job_name):
+        self.launcher = launcher
+        self.job_name = job_name
+        self.killed = False
+        self.returncode = None
+
+    def check(self):
+        queue_dir = self.launcher.queue_dir
+        if (queue_dir / "done" / self.job_name).exists():
+            return 0
+        failed_path = queue_dir / "failed" / self.job_name
+        if failed_path.exists():
+            try:
+                return json.loads(failed_path.read_text(encoding="utf-8")).get("returncode", 1) or 1
+            except (ValueError, OSError):
+                return 1
+        return None
+
+    def wait(self):
+        while self.returncode is None:
+            if self.killed:
+                self.returncode = -1
+                break
+            self.returncode = self.check()
+            if self.returncode is None:
+                self.launcher.reap()
+                sleep(self.launcher.poll_interval)
+            else:
+                # Result read: drop the job file, or a long run leaves one per step in the shared directory.
+                for sub in ("done", "failed"):
+                    (self.launcher.queue_dir / sub / self.job_name).unlink(missing_ok=True)
+        return self.returncode
+
+    def poll(self):
+        return self.returncode
+
+    # Withdraws the job if nobody has claimed it yet. A job already leased runs to the end on its worker.
+    def kill(self):
+        if self.returncode is None:
+            self.killed = True
+            (self.launcher.queue_dir / "todo" / self.job_name).unlink(missing_ok=True)
+
+
+# Drop-in for ArgvLauncher: launch() and export() queue the step instead of running it here.
+class QueueLauncher(object):
+    def __init__(self, queue_dir, stale_secs=120.0, poll_interval=0.2):
+        self.queue_dir = make_queue(queue_dir)
+        # The run directory, which all job paths are relative to.
+        self.root = self.queue_dir.parent
+        self.stale_secs = stale_secs
+        self.poll_interval = poll_interval
+        self.reap_lock = threading.Lock()
+        self.last_reap = monotonic()
+
+    def rel(self, path):
+        return str(Path(path).resolve().relative_to(self.root.resolve()))
+
+    def enqueue(self, job_name, argvs):
+        # Clear what a previous attempt at this step left behind, e.g. before a resume.
+        for sub in ("done", "failed"):
+            (self.queue_dir / sub / job_name).unlink(missing_ok=True)
+        write_job(self.queue_dir, job_name, {"name": job_name, "argvs": argvs,
+                                             "queued": datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
+        return QueuedJob(self, job_name)
+
+    # Same "s Nu in out" calls as ArgvLauncher.step_argvs, minus the executable: each worker adds its own.
+    def launch(self, evin_path, evout_path, updates):
+        evout_path = Path(evout_path)
+        return self.enqueue(evout_path.name + ".job",
+                            [["s", str(updates) + "u", self.rel(evin_path), self.rel(evout_path.with_suffix(".evolve"))],
+                             ["s", "0u", self.rel(evout_path.with_suffix(".evolve")),
+                              self.rel(evout_path.with_suffix(".txt"))]])
+
+    def export(self, evin_path):
+        evin_path = Path(evin_path)
+        return self.enqueue(evin_path.stem + ".export.job",
+                            [["s", "0u", self.rel(evin_path), self.rel(evin_path.with_suffix(".txt"))]])
+
+    # Every waiting job calls this, but the directory is only scanned once per stale_secs/4.
+    def reap(self):
+        with self.reap_lock:
+            if monotonic() - self.last_reap < self.stale_secs / 4:
+                return []
+            self.last_reap = monotonic()
+        return reap_leases(self.queue_dir, self.stale_secs)
+
+
+def job_step(job_name):
+    stnm = job_name.split(".")[0].split("_")[-1]
+    return int(stnm) if stnm.isdigit() else -1
+
+
+# Claim the lowest-numbered job in todo. Returns the lease path, or None if there is nothing to claim.
+def claim_job(queue_dir, wid):
+    jobs = [p.name for p in (Path(queue_dir) / "todo").iterdir() if p.suffix == ".job"]
+    # Earliest steps first, so the coordinator can keep scraping in order.
+    jobs.sort(key=job_step)
+    for job_name in jobs:
+        lease_path = Path(queue_dir) / "leased" / (job_name + lease_sep + wid)
+        try:
+            os.rename(Path(queue_dir) / "todo" / job_name, lease_path)
+        except FileNotFoundError:
+            # Another worker got there first.
+            continue
+        # Rename keeps the mtime from when the job was queued, so start the lease clock now.
+        try:
+            os.utime(lease_path)
+        except FileNotFoundError:
+            # Reaped as stale in between, because of that old mtime.
+            continue
+        return lease_path
+    return None
+
+
+# Run one leased job, touching the lease every heartbeat seconds so the coordinator knows it is alive.
+def run_job(queue_dir, lease_path, argv_launcher, heartbeat):
+    queue_dir = Path(queue_dir)
+    job = json.loads(lease_path.read_text(encoding="utf-8"))
+    root = queue_dir.parent
+    argvs = []
+    for args in job["argvs"]:
+        # Paths are the last two arguments of "s Nu in out".
+        argvs.append(argv_launcher.prefix + args[:2] + [str((root / a).resolve()) for a in args[2:]])
+    proc = baru.ChainedProcess(argvs, argv_launcher.cwd)
+    waiter = threading.Thread(target=proc.wait, daemon=True)
+    waiter.start()
+    while waiter.is_alive():
+        waiter.join(heartbeat)
+        try:
+            os.utime(lease_path)
+        except FileNotFoundError:
+            # Reaped while still running; someone else owns the job now.
+            proc.kill()
+            waiter.join()
+            print("Lost the lease on " + job["name"] + ", dropping it.")
+            return None
+    rc = proc.returncode
+    job.update({"returncode": rc, "worker": lease_path.name.split(lease_sep)[-1],
+                "finished": datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
+    lease_path.write_text(json.dumps(job), encoding="utf-8")
+    try:
+        os.rename(lease_path, queue_dir / ("done" if rc == 0 else "failed") / job["name"])
+    except FileNotFoundError:
+        print("Lost the lease on " + job["name"] + ", dropping it.")
+        return None
+    return rc
+
+
+# Keep claiming and running jobs from any of the queues. Stops after idle_exit seconds with nothing to do.
+def work(queue_dirs, evolve_exe=None, idle_exit=None, heartbeat=10.0, poll_interval=0.5):
+    queue_dirs = [make_queue(q) for q in queue_dirs]
+    argv_launcher = baru.ArgvLauncher(evolve_exe)
+    wid = worker_id()
+    print("Worker " + wid + " started at " + datetime.now().strftime("%H:%M:%S"))
+    ran = 0
+    idle_since = monotonic()
+    while idle_exit is None or monotonic() - idle_since < idle_exit:
+        for queue_dir in queue_dirs:
+            lease_path = claim_job(queue_dir, wid)
+            if lease_path is not None:
+                run_job(queue_dir, lease_path, argv_launcher, heartbeat)
+                ran += 1
+                idle_since = monotonic()
+                break
+        else:
+            sleep(poll_interval)
+    print("Worker " + wid + " ran " + str(ran) + " jobs, stopped at " + datetime.now().strftime("%H:%M:%S"))
+    return ran
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run queued evolve_batch steps from shared run directories.")
+    parser.add_argument("queue_dirs", nargs="+")
+    # Extra words after the path make it an argv prefix, e.g. "python evolve_standin.py --exact".
+    parser.add_argument("--evolve-exe", default=None)
+    parser.add_argument("--idle-exit", type=float, default=None)
+    parser.add_argument("--heartbeat", type=float, default=10.0)
+    args = parser.parse_args()
+    evolve_exe = None
+    if args.evolve_exe:
+        evolve_exe = shlex.split(args.evolve_exe, posix=(os.name != "nt"))
+    work(args.queue_dirs, evolve_exe, args.idle_exit, args.heartbeat)
+    sys.exit(0)